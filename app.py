@@ -1,25 +1,87 @@
-from flask import Flask, render_template, request, jsonify
-from crawler import MissEvanCrawler
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from crawler import (MissEvanCrawler, DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+                     DEFAULT_RETRIES, DEFAULT_COVER_REQUESTS_PER_SECOND, SEARCH_MAX_WORKERS)
+from cache import DiskCache
+from userset import UserIdSet
+from hll import HyperLogLog, DEFAULT_PRECISION, MIN_PRECISION, MAX_PRECISION
+from jobs import JobScheduler, JobQueueFull, JobCancelled, create_job_store
+from checkpoint import CrawlCheckpoint
+from stats import DramaStats
+import metrics
+from export import DEFAULT_EXPORT_DIR, EXPORT_FORMATS, PARQUET_AVAILABLE, package_export
 from flask_cors import CORS
-import threading
-import queue
 import os
-import time
+import json
+import hashlib
+import shutil
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# 创建全局爬虫实例
-crawler = MissEvanCrawler()
+# 分集弹幕并发抓取的线程数，所有请求共享的每秒请求数上限和允许的瞬时突发请求数
+CRAWL_WORKERS = int(os.environ.get('CRAWL_WORKERS', 4))
+CRAWL_REQUESTS_PER_SECOND = float(os.environ.get('CRAWL_REQUESTS_PER_SECOND', 2.0))
+CRAWL_BURST = float(os.environ.get('CRAWL_BURST', 8))
+# gunicorn 多进程部署时每个进程各有一个限流器，按进程数平分总的请求速率
+WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
 
-# 用于存储爬取进度的全局变量
-crawl_progress = {}
+# 猫耳FM站点地址，可指向本地模拟服务（mock_missevan.py）做离线测试
+MISSEVAN_BASE_URL = os.environ.get('MISSEVAN_BASE_URL', DEFAULT_BASE_URL)
+# 上游请求的连接/读取超时（秒），以及连接失败和 502/503/504 的自动重试次数
+CRAWL_CONNECT_TIMEOUT = float(os.environ.get('CRAWL_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT))
+CRAWL_READ_TIMEOUT = float(os.environ.get('CRAWL_READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+CRAWL_RETRIES = int(os.environ.get('CRAWL_RETRIES', DEFAULT_RETRIES))
+
+# 后台任务调度：固定数量的爬取线程、有上限的等待队列、结束任务的保留时间（秒）
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 16))
+JOB_TTL = float(os.environ.get('JOB_TTL', 600))
+# 每个任务保留的进度消息条数（断线重连时可从中补发），以及 SSE 心跳间隔（秒）
+JOB_BUFFER_SIZE = int(os.environ.get('JOB_BUFFER_SIZE', 1000))
+SSE_KEEPALIVE = 15
+# 任务状态的存储方式：memory（单进程）或 sqlite（多个 gunicorn 进程共享同一个文件）
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'memory')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'missevan_jobs.sqlite3')
+# 批量统计一次最多包含的广播剧数
+BATCH_MAX_DRAMAS = int(os.environ.get('BATCH_MAX_DRAMAS', 200))
+# 封面图片服务器的每秒请求数上限（独立于接口的限流器，同样按进程数平分）
+COVER_REQUESTS_PER_SECOND = float(os.environ.get('COVER_REQUESTS_PER_SECOND', DEFAULT_COVER_REQUESTS_PER_SECOND))
+# 浏览器缓存封面缩略图的时间（秒）
+COVER_MAX_AGE = int(os.environ.get('COVER_MAX_AGE', 7 * 24 * 3600))
+
+# 创建全局爬虫实例（所有请求线程共享同一个限流器、连接池和磁盘缓存）
+# 连接池大小按同时运行的任务数 × 每个任务的抓取线程数，再加上搜索的并发线程数
+crawler = MissEvanCrawler(requests_per_second=CRAWL_REQUESTS_PER_SECOND / WEB_CONCURRENCY,
+                          cache=DiskCache(), burst=max(1.0, CRAWL_BURST / WEB_CONCURRENCY),
+                          base_url=MISSEVAN_BASE_URL,
+                          pool_size=JOB_WORKERS * CRAWL_WORKERS + SEARCH_MAX_WORKERS,
+                          timeout=(CRAWL_CONNECT_TIMEOUT, CRAWL_READ_TIMEOUT), retries=CRAWL_RETRIES,
+                          cover_requests_per_second=COVER_REQUESTS_PER_SECOND / WEB_CONCURRENCY)
+
+# 同一广播剧同时只有一个进行中的任务
+scheduler = JobScheduler(max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING,
+                         finished_ttl=JOB_TTL,
+                         store=create_job_store(JOB_BACKEND, JOB_DB_PATH, JOB_BUFFER_SIZE))
+metrics.JOB_QUEUE_DEPTH.set_function(lambda: scheduler.pending_count)
+metrics.JOBS_ACTIVE.set_function(lambda: scheduler.active_count)
 
 @app.route('/')
 def index():
     """渲染主页"""
     return render_template('index.html')
 
+def parse_count_options(data):
+    """解析统计选项，返回 (是否增量抓取, HyperLogLog 精度或 None, 错误信息)"""
+    incremental = bool(data.get('incremental', True))  # 是否只合并上次抓取之后的新弹幕
+    mode = data.get('mode', 'exact')  # exact: 精确统计；approx: HyperLogLog 估算
+    precision = int(data.get('precision', DEFAULT_PRECISION))
+    
+    if mode not in ('exact', 'approx'):
+        return incremental, None, 'mode 只能是 exact 或 approx'
+    if not MIN_PRECISION <= precision <= MAX_PRECISION:
+        return incremental, None, f'precision 必须在 {MIN_PRECISION} 到 {MAX_PRECISION} 之间'
+    return incremental, (precision if mode == 'approx' else None), None
+
 @app.route('/api/start_crawl', methods=['POST'])
 def start_crawl():
     """开始爬取数据"""
@@ -27,136 +89,425 @@ def start_crawl():
         data = request.get_json()
         drama_id = int(data.get('drama_id', 0))
         drama_name = data.get('drama_name', '')  # 从请求中获取广播剧名称
+        incremental, precision, error = parse_count_options(data)
+        # 同时统计每集弹幕数、发弹幕最多的用户、用户覆盖分集数和视频时间热力图
+        collect_stats = bool(data.get('stats', False))
         
         if drama_id <= 0:
             return jsonify({'error': '请输入有效的广播剧ID'}), 400
+        if error:
+            return jsonify({'error': error}), 400
+        approximate = precision is not None
         
-        # 创建新的进度队列
-        progress_queue = queue.Queue()
-        crawl_progress[drama_id] = progress_queue
-        
-        # 如果没有提供广播剧名称，尝试从API获取
-        if not drama_name:
+        def crawl_task(job):
+            timings = metrics.begin_timings()
+            name = drama_name
             try:
-                url = f"{crawler.drama_api_url}/getdrama?drama_id={drama_id}"
-                response = crawler.session.get(url)
-                response.raise_for_status()
-                data = response.json()
+                # 如果没有提供广播剧名称，尝试从API获取
+                if not name:
+                    drama_info = crawler.get_drama_info(drama_id)
+                    if drama_info:
+                        name = (drama_info.get("drama") or {}).get("name") or drama_info.get("name") or "未知广播剧"
+                        print(f"获取到广播剧名称: {name}")  # 调试日志
+                    else:
+                        name = "未知广播剧"
+                        print(f"获取广播剧信息失败: {drama_id}")  # 调试日志
                 
-                if data.get("success"):
-                    drama_info = data.get("info", {})
-                    drama_name = drama_info.get("name", "未知广播剧")
-                    print(f"获取到广播剧名称: {drama_name}")  # 调试日志
-                else:
-                    drama_name = "未知广播剧"
-                    print(f"获取广播剧信息失败: {data.get('info', '未知错误')}")  # 调试日志
-            except Exception as e:
-                print(f"获取广播剧信息失败: {e}")
-                drama_name = "未知广播剧"
-        
-        def crawl_task():
-            try:
                 # 获取所有分集信息
                 episodes = crawler.get_drama_sounds(drama_id)
                 if not episodes:
-                    progress_queue.put({
+                    job.put({
                         'status': 'error',
                         'message': "未找到付费分集信息"
                     })
-                    return
+                    return None
                 
-                # 获取每个分集的弹幕数量
-                total_danmaku_users = set()  # 用于统计总体的不重复用户数
+                # 并发获取各分集的弹幕用户，请求节奏由爬虫实例共享的限流器控制
+                # 用于统计总体的不重复用户数：精确模式用紧凑数组，估算模式用 HyperLogLog
+                total_danmaku_users = HyperLogLog(precision) if approximate else UserIdSet()
                 total_episodes = len(episodes)
                 
-                for idx, episode in enumerate(episodes, 1):
+                # 从上次中断（进程重启或任务取消）时保存的检查点继续，跳过已完成的分集
+                # 统计模式需要每个分集的明细，不跳过已完成的分集（分集统计有缓存，重新汇总代价很小）
+                # 检查点按精度和是否增量区分，要求完整重新统计时不会沿用增量统计的进度
+                checkpoint = CrawlCheckpoint(
+                    crawler.cache,
+                    f"drama:{drama_id}:{precision or 'exact'}:{'incremental' if incremental else 'full'}"
+                )
+                done_sound_ids, total_danmaku_users = checkpoint.load(total_danmaku_users)
+                if collect_stats:
+                    done_sound_ids = set()
+                drama_stats = DramaStats() if collect_stats else None
+                failed_episodes = 0
+                pending_episodes = [ep for ep in episodes if ep.get("sound_id") not in done_sound_ids]
+                completed = total_episodes - len(pending_episodes)
+                if completed:
+                    job.put({
+                        'status': 'info',
+                        'message': f"从检查点恢复：已完成 {completed}/{total_episodes} 个分集"
+                    })
+                
+                results = crawler.iter_episode_danmaku(
+                    pending_episodes,
+                    max_workers=CRAWL_WORKERS,
+                    incremental=incremental,
+                    precision=precision,
+                    stats=collect_stats
+                )
+                for idx, episode, danmaku_ids, fetched in results:
+                    if job.cancelled:
+                        checkpoint.save(total_danmaku_users)
+                        job.check_cancelled()
                     try:
-                        sound_id = episode.get("sound_id")
                         title = episode.get("name", "未知标题")
+                        completed += 1
+                        if drama_stats is not None:
+                            drama_stats.add(episode, danmaku_ids)
+                            danmaku_ids = danmaku_ids.user_ids
                         
                         # 更新进度
-                        progress = (idx / total_episodes) * 100
-                        progress_queue.put({
+                        job.put({
                             'status': 'progress',
-                            'current': idx,
+                            'current': completed,
                             'total': total_episodes,
-                            'message': f"正在处理: {title}"
+                            'message': f"已完成: {title}"
                         })
                         
-                        if sound_id:
-                            # 获取弹幕用户ID
-                            danmaku_ids = crawler.get_danmaku_ids(sound_id)
+                        with metrics.timer("merge"):
                             total_danmaku_users.update(danmaku_ids)  # 添加到总用户集合中
-                            
-                            # 添加进度消息
-                            progress_queue.put({
-                                'status': 'info',
-                                'message': f"分集 {title} 弹幕用户数: {len(danmaku_ids)}"
-                            })
-                            progress_queue.put({
-                                'status': 'info',
-                                'message': f"当前累计不重复用户数: {len(total_danmaku_users)}"
+                        # 抓取失败的分集只合并了上次缓存的结果，不记入检查点，恢复时重新抓取
+                        if fetched:
+                            checkpoint.record(episode["sound_id"], total_danmaku_users)
+                        else:
+                            failed_episodes += 1
+                            job.put({
+                                'status': 'error',
+                                'message': f"分集 {title} 弹幕获取失败，结果可能偏少"
                             })
-                            
-                            # 根据进度动态调整延时
-                            if idx < total_episodes:
-                                delay = 0.5 if idx % 5 != 0 else 1.0  # 每5个请求增加一次延时
-                                time.sleep(delay)
+                        
+                        # 添加进度消息
+                        job.put({
+                            'status': 'info',
+                            'message': f"分集 {title} 弹幕用户数: {len(danmaku_ids)}"
+                        })
+                        job.put({
+                            'status': 'info',
+                            'message': f"当前累计不重复用户数: {len(total_danmaku_users)}"
+                        })
                                 
                     except Exception as e:
-                        progress_queue.put({
+                        job.put({
                             'status': 'error',
                             'message': f"处理分集时出错: {str(e)}"
                         })
                         continue
                 
-                # 添加最终结果
-                progress_queue.put({
+                # 添加最终结果；全部分集成功后不再需要检查点，否则保留检查点，重新统计时只抓取失败的分集
+                if failed_episodes:
+                    checkpoint.save(total_danmaku_users)
+                else:
+                    checkpoint.clear()
+                unique_users = len(total_danmaku_users)
+                result = {'unique_users': unique_users, 'approximate': approximate}
+                message = f"广播剧：{name}\n总计不重复弹幕用户数: {unique_users}"
+                if failed_episodes:
+                    result['failed_episodes'] = failed_episodes
+                    message += f"\n{failed_episodes} 个分集获取失败，重新统计时将只抓取这些分集"
+                if approximate:
+                    result['error_bound'] = total_danmaku_users.error_bound
+                    message += f"（估算值，标准误差约 ±{total_danmaku_users.error_bound:.2%}）"
+                if drama_stats is not None:
+                    result['stats'] = drama_stats.to_dict(sound_ids=[ep.get("sound_id") for ep in episodes])
+                    message += f"\n总弹幕数: {result['stats']['comments']}"
+                result['timings'] = timings.summary()
+                job.put({
                     'status': 'complete',
-                    'message': f"广播剧：{drama_name}\n总计不重复弹幕用户数: {len(total_danmaku_users)}"
+                    'message': message,
+                    'result': result
                 })
+                return result
                 
+            except JobCancelled:
+                job.put({
+                    'status': 'error',
+                    'message': "任务已取消"
+                })
+                raise
             except Exception as e:
-                progress_queue.put({
+                job.put({
                     'status': 'error',
                     'message': f"爬取过程出错: {str(e)}"
                 })
+                raise
         
-        # 启动爬虫任务
-        thread = threading.Thread(target=crawl_task)
-        thread.daemon = True
-        thread.start()
+        # 提交爬虫任务；同一广播剧、相同统计选项已有进行中的任务时直接加入，共享进度和结果
+        key = ('drama', drama_id, precision, incremental, collect_stats)
+        try:
+            job, created = scheduler.submit(crawl_task, key=key, group=('drama', drama_id))
+        except JobQueueFull:
+            return jsonify({'error': '当前任务过多，请稍后再试'}), 429
         
-        return jsonify({'message': '开始爬取', 'drama_id': drama_id})
+        if not created:
+            return jsonify({'message': '已加入进行中的任务', 'drama_id': drama_id, 'job_id': job.id, 'joined': True})
+        return jsonify({'message': '开始爬取', 'drama_id': drama_id, 'job_id': job.id})
         
     except ValueError:
         return jsonify({'error': '请输入有效的数字ID'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/start_batch_crawl', methods=['POST'])
+def start_batch_crawl():
+    """批量统计多部广播剧，共用一个抓取流程，返回每部剧及合计的不重复用户数"""
+    try:
+        data = request.get_json()
+        drama_ids = [int(drama_id) for drama_id in data.get('drama_ids', [])]
+        incremental, precision, error = parse_count_options(data)
+        
+        if not drama_ids or any(drama_id <= 0 for drama_id in drama_ids):
+            return jsonify({'error': '请提供有效的广播剧ID列表'}), 400
+        if len(drama_ids) > BATCH_MAX_DRAMAS:
+            return jsonify({'error': f'一次最多统计 {BATCH_MAX_DRAMAS} 部广播剧'}), 400
+        if error:
+            return jsonify({'error': error}), 400
+        
+        def batch_task(job):
+            timings = metrics.begin_timings()
+            
+            def on_episode(done, total, episode):
+                job.check_cancelled()
+                job.put({
+                    'status': 'progress',
+                    'current': done,
+                    'total': total,
+                    'message': f"已完成: {episode.get('name', '未知标题')}"
+                })
+            
+            try:
+                result = crawler.crawl_dramas(drama_ids, max_workers=CRAWL_WORKERS, incremental=incremental,
+                                              precision=precision, on_episode=on_episode)
+            except JobCancelled:
+                job.put({'status': 'error', 'message': "任务已取消"})
+                raise
+            except Exception as e:
+                job.put({'status': 'error', 'message': f"批量统计出错: {str(e)}"})
+                raise
+            
+            result['timings'] = timings.summary()
+            if result['failed_episodes']:
+                failed_dramas = [str(drama['drama_id']) for drama in result['dramas'] if drama['failed_episodes']]
+                job.put({
+                    'status': 'error',
+                    'message': f"{result['failed_episodes']} 个分集弹幕获取失败，"
+                               f"广播剧 {', '.join(failed_dramas)} 的结果可能偏少"
+                })
+            job.put({
+                'status': 'complete',
+                'message': f"共 {len(drama_ids)} 部广播剧，合计不重复弹幕用户数: {result['unique_users']}",
+                'result': result
+            })
+            return result
+        
+        key = ('batch', tuple(sorted(set(drama_ids))), precision, incremental)
+        try:
+            job, created = scheduler.submit(batch_task, key=key)
+        except JobQueueFull:
+            return jsonify({'error': '当前任务过多，请稍后再试'}), 429
+        
+        return jsonify({'message': '开始批量统计' if created else '已加入进行中的任务',
+                        'job_id': job.id, 'joined': not created})
+        
+    except (TypeError, ValueError):
+        return jsonify({'error': '请提供有效的广播剧ID列表'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def job_progress_response(job):
+    """返回任务在 cursor 之后的进度消息"""
+    cursor = request.args.get('cursor', 0, type=int)
+    messages, cursor = job.read(cursor)
+    
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'messages': messages,
+        'cursor': cursor,
+        'finished': job.finished
+    })
+
 @app.route('/api/get_progress/<int:drama_id>')
 def get_progress(drama_id):
-    """获取爬取进度"""
+    """获取该广播剧最近一次爬取任务的进度，cursor 为上次返回的游标，只返回之后的新消息"""
     try:
-        if drama_id not in crawl_progress:
+        job = scheduler.get_latest(('drama', drama_id))
+        if job is None:
             return jsonify({'error': '未找到该任务'}), 404
-            
-        progress_queue = crawl_progress[drama_id]
-        messages = []
+        return job_progress_response(job)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """按任务ID获取任务状态和进度"""
+    try:
+        job = scheduler.get(job_id)
+        if job is None:
+            return jsonify({'error': '未找到该任务'}), 404
+        return job_progress_response(job)
         
-        # 获取所有可用的进度消息
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    """以 Server-Sent Events 推送任务进度，支持通过 Last-Event-ID 断线续传"""
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': '未找到该任务'}), 404
+    
+    # 事件ID即消息序号，从上次收到的下一条开始推送
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        cursor = int(last_event_id) + 1 if last_event_id else 0
+    except ValueError:
+        cursor = 0
+    
+    def generate():
+        nonlocal cursor
         while True:
+            messages, next_cursor = job.wait(cursor, timeout=SSE_KEEPALIVE)
+            first_id = next_cursor - len(messages)
+            for i, message in enumerate(messages):
+                yield f"id: {first_id + i}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+            cursor = next_cursor
+            if job.finished and not messages:
+                yield f"event: end\ndata: {json.dumps({'status': job.status})}\n\n"
+                return
+            if not messages:
+                yield ": keep-alive\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务"""
+    try:
+        if not scheduler.cancel(job_id):
+            return jsonify({'error': '任务不存在或已结束'}), 404
+        return jsonify({'message': '已请求取消任务', 'job_id': job_id})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export', methods=['POST'])
+def start_export():
+    """把一部广播剧付费分集的全部弹幕按列导出，完成后可通过下载地址获取"""
+    try:
+        data = request.get_json()
+        drama_id = int(data.get('drama_id', 0))
+        fmt = data.get('format', 'npy')
+        with_text = bool(data.get('text', False))
+        
+        if drama_id <= 0:
+            return jsonify({'error': '请输入有效的广播剧ID'}), 400
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f"format 只能是 {' 或 '.join(EXPORT_FORMATS)}"}), 400
+        if fmt == 'parquet' and not PARQUET_AVAILABLE:
+            return jsonify({'error': '服务器未安装 pyarrow，无法导出 Parquet'}), 400
+        
+        def export_task(job):
+            timings = metrics.begin_timings()
+            episodes = crawler.get_drama_sounds(drama_id)
+            if not episodes:
+                job.put({'status': 'error', 'message': "未找到付费分集信息"})
+                return None
+            
+            def on_episode(done, total, episode):
+                job.check_cancelled()
+                job.put({
+                    'status': 'progress',
+                    'current': done,
+                    'total': total,
+                    'message': f"已导出: {episode.get('name', '未知标题')}"
+                })
+            
+            # 先写到以任务ID命名的临时位置，完成后再替换，避免覆盖正在被下载的文件
+            name = f"drama-{drama_id}{'-text' if with_text else ''}"
+            suffix = '.zip' if fmt == 'npy' else '.parquet'
+            tmp_path = os.path.join(DEFAULT_EXPORT_DIR, f"{name}-{job.id}")
             try:
-                message = progress_queue.get_nowait()
-                messages.append(message)
-            except queue.Empty:
-                break
+                meta = crawler.export_danmaku(episodes, tmp_path if fmt == 'npy' else tmp_path + suffix,
+                                              fmt=fmt, with_text=with_text, max_workers=CRAWL_WORKERS,
+                                              on_episode=on_episode)
+                if fmt == 'npy':
+                    package_export(tmp_path)
+                os.replace(tmp_path + suffix, os.path.join(DEFAULT_EXPORT_DIR, name + suffix))
+            except Exception as e:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                if os.path.exists(tmp_path + suffix):
+                    os.remove(tmp_path + suffix)
+                job.put({'status': 'error',
+                         'message': "任务已取消" if isinstance(e, JobCancelled) else f"导出出错: {str(e)}"})
+                raise
+            
+            result = {
+                'rows': meta['rows'],
+                'episodes': len(meta['sound_ids']),
+                'failed': meta['failed'],
+                'format': fmt,
+                'download': f"/api/exports/{name}{suffix}",
+                'timings': timings.summary()
+            }
+            job.put({
+                'status': 'complete',
+                'message': f"导出完成，共 {meta['rows']} 条弹幕",
+                'result': result
+            })
+            return result
         
-        return jsonify({'messages': messages})
+        try:
+            job, created = scheduler.submit(export_task, key=('export', drama_id, fmt, with_text))
+        except JobQueueFull:
+            return jsonify({'error': '当前任务过多，请稍后再试'}), 429
+        return jsonify({'message': '开始导出' if created else '已加入进行中的任务',
+                        'drama_id': drama_id, 'job_id': job.id, 'joined': not created})
         
+    except ValueError:
+        return jsonify({'error': '请输入有效的数字ID'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/exports/<path:filename>')
+def download_export(filename):
+    """下载导出文件"""
+    return send_from_directory(os.path.abspath(DEFAULT_EXPORT_DIR), filename, as_attachment=True)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """以 Prometheus 文本格式输出本进程的指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def cover_url(drama_id):
+    """广播剧封面缩略图的地址（经本服务代理和缓存）"""
+    return f'/api/cover/{drama_id}'
+
+@app.route('/api/cover/<int:drama_id>')
+def drama_cover(drama_id):
+    """返回广播剧封面的缩略图，带强 ETag，浏览器重新验证时返回 304"""
+    cover = crawler.get_cover_thumbnail(drama_id)
+    if cover is None:
+        return jsonify({'error': '未找到封面'}), 404
+    data, content_type = cover
+    response = Response(data, mimetype=content_type)
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = COVER_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/api/search', methods=['GET'])
 def search_drama():
     """搜索广播剧"""
@@ -173,22 +524,23 @@ def search_drama():
             drama_id = int(keyword)
             print(f"Converting keyword to ID: {drama_id}")  # 添加调试日志
             
-            # 如果是数字，直接获取广播剧信息
+            # 如果是数字，直接获取广播剧信息（命中缓存时不请求上游）
             drama_info = crawler.get_drama_sounds(drama_id)
             if not drama_info:
                 print(f"No drama found with ID: {drama_id}")  # 添加调试日志
                 return jsonify({'error': '未找到该广播剧'}), 404
                 
-            # 获取广播剧名称
-            drama_name = drama_info[0].get('name', '未知标题') if drama_info else '未知标题'
+            # 优先使用本地索引中记录的广播剧名称、作者和封面
+            indexed = crawler.drama_index.get(drama_id) or {}
+            drama_name = indexed.get('name') or drama_info[0].get('name', '未知标题')
             print(f"Found drama: {drama_name}")  # 添加调试日志
             
             return jsonify({
                 'results': [{
                     'drama_id': drama_id,
                     'name': drama_name,
-                    'author': '未知',
-                    'cover': 'https://static.missevan.com/assets/images/avatar.png'
+                    'author': indexed.get('author') or '未知',
+                    'cover': cover_url(drama_id)
                 }]
             })
             
@@ -204,7 +556,7 @@ def search_drama():
                     print(f"No results found for keyword: {keyword}")  # 添加调试日志
                     return jsonify({'results': [], 'message': '未找到相关广播剧'})
                 
-                return jsonify({'results': results})
+                return jsonify({'results': [{**drama, 'cover': cover_url(drama['drama_id'])} for drama in results]})
             except Exception as e:
                 print(f"Search error: {str(e)}")  # 添加调试日志
                 return jsonify({'error': f'搜索失败: {str(e)}'}), 500
@@ -0,0 +1,149 @@
+"""以 ASGI 方式运行网页服务（可选，默认仍使用 Flask + gunicorn）
+
+搜索、封面缩略图和任务进度推送（SSE）在事件循环中处理，使用 AsyncMissEvanCrawler 请求上游，
+等待上游响应时不占用线程，一个进程可以同时处理大量搜索和进度连接；其余接口交给
+app.py 中的 Flask 应用（在线程池中运行），后台统计任务照旧在 JobScheduler 的线程中执行。
+
+用法：pip install httpx starlette uvicorn a2wsgi
+      uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import hashlib
+import json
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # 没有安装 a2wsgi 时使用 Starlette 自带的实现
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as flask_app
+from async_crawler import AsyncMissEvanCrawler
+from jobs import POLL_INTERVAL, MemoryJobStore
+
+async_crawler = AsyncMissEvanCrawler(flask_app.crawler, retries=flask_app.CRAWL_RETRIES)
+# 进程内任务存储只读写内存，直接在事件循环中调用；SQLite 存储会阻塞，放到线程中执行
+JOB_STORE_BLOCKS = not isinstance(flask_app.scheduler.store, MemoryJobStore)
+
+
+async def call_job_store(fn, *args):
+    if JOB_STORE_BLOCKS:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def search_drama(request):
+    """搜索广播剧，与 Flask 版本的 /api/search 返回相同的结果"""
+    keyword = request.query_params.get('keyword', '').strip()
+    if not keyword:
+        return JSONResponse({'error': '请输入搜索关键词'}, status_code=400)
+
+    try:
+        drama_id = int(keyword)
+    except ValueError:
+        drama_id = None
+
+    try:
+        if drama_id is not None:
+            # 如果是数字，直接获取广播剧信息（命中缓存时不请求上游）
+            episodes = await async_crawler.get_drama_sounds(drama_id)
+            if not episodes:
+                return JSONResponse({'error': '未找到该广播剧'}, status_code=404)
+            indexed = flask_app.crawler.drama_index.get(drama_id) or {}
+            return JSONResponse({
+                'results': [{
+                    'drama_id': drama_id,
+                    'name': indexed.get('name') or episodes[0].get('name', '未知标题'),
+                    'author': indexed.get('author') or '未知',
+                    'cover': flask_app.cover_url(drama_id)
+                }]
+            })
+
+        results = await async_crawler.search_drama(keyword)
+        if not results:
+            return JSONResponse({'results': [], 'message': '未找到相关广播剧'})
+        return JSONResponse({'results': [{**drama, 'cover': flask_app.cover_url(drama['drama_id'])}
+                                         for drama in results]})
+    except Exception as e:
+        print(f"Search error: {str(e)}")
+        return JSONResponse({'error': f'搜索失败: {str(e)}'}, status_code=500)
+
+
+async def drama_cover(request):
+    """返回广播剧封面的缩略图，带强 ETag，浏览器重新验证时返回 304"""
+    cover = await async_crawler.get_cover_thumbnail(request.path_params['drama_id'])
+    if cover is None:
+        return JSONResponse({'error': '未找到封面'}, status_code=404)
+    data, content_type = cover
+    headers = {
+        'ETag': f'"{hashlib.sha1(data).hexdigest()}"',
+        'Cache-Control': f'public, max-age={flask_app.COVER_MAX_AGE}'
+    }
+    if headers['ETag'] in request.headers.get('If-None-Match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type=content_type, headers=headers)
+
+
+async def stream_job_events(request):
+    """以 Server-Sent Events 推送任务进度，支持通过 Last-Event-ID 断线续传"""
+    job = await call_job_store(flask_app.scheduler.get, request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'error': '未找到该任务'}, status_code=404)
+
+    # 事件ID即消息序号，从上次收到的下一条开始推送
+    last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    try:
+        cursor = int(last_event_id) + 1 if last_event_id else 0
+    except ValueError:
+        cursor = 0
+
+    async def generate():
+        nonlocal cursor
+        idle = 0.0
+        while True:
+            # 先读取状态再读取消息，任务结束前的最后几条消息不会被漏掉
+            finished = await call_job_store(lambda: job.finished)
+            messages, next_cursor = await call_job_store(job.read, cursor)
+            first_id = next_cursor - len(messages)
+            for i, message in enumerate(messages):
+                yield f"id: {first_id + i}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+            cursor = next_cursor
+            if messages:
+                idle = 0.0
+                continue
+            if finished:
+                status = await call_job_store(lambda: job.status)
+                yield f"event: end\ndata: {json.dumps({'status': status})}\n\n"
+                return
+            if idle >= flask_app.SSE_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            # 轮询新消息，等待期间不占用线程
+            await asyncio.sleep(POLL_INTERVAL)
+            idle += POLL_INTERVAL
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@asynccontextmanager
+async def lifespan(_):
+    yield
+    await async_crawler.aclose()
+
+
+app = Starlette(routes=[
+    Route('/api/search', search_drama),
+    Route('/api/cover/{drama_id:int}', drama_cover),
+    Route('/api/jobs/{job_id}/events', stream_job_events),
+    Mount('/', app=WSGIMiddleware(flask_app.app))
+], middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+   lifespan=lifespan)
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:  # httpx 为可选依赖，只有异步服务（asgi.py）需要
+    httpx = None
+
+try:
+    import h2  # noqa: F401  安装了 h2 时与上游使用 HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+import metrics
+from crawler import (MissEvanCrawler, DEFAULT_RETRIES, RETRY_BACKOFF_FACTOR, RETRY_BACKOFF_JITTER,
+                     RETRY_STATUSES)
+from ratelimit import TokenBucket, parse_retry_after
+from search_index import normalize_keyword
+from singleflight import AsyncSingleFlight
+from thumbnail import THUMBNAIL_SIZE, make_thumbnail
+
+# 异步客户端与上游的最大连接数（并发请求数仍受限流器约束）
+DEFAULT_MAX_CONNECTIONS = 100
+
+
+class AsyncMissEvanCrawler:
+    """MissEvanCrawler 中网页接口用到的抓取方法的异步版本（基于 httpx）
+
+    与同步爬虫共享限流器、磁盘缓存、广播剧信息缓存、搜索缓存和广播剧索引，
+    两者获取的结果互相可见；后台统计任务仍在线程中使用同步爬虫。
+    读写磁盘缓存（SQLite）会阻塞，都放到线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, crawler: MissEvanCrawler, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 retries: int = DEFAULT_RETRIES):
+        if httpx is None:
+            raise RuntimeError("异步爬虫需要安装 httpx")
+        self.crawler = crawler
+        self.rate_limiter = crawler.rate_limiter
+        self.retries = retries
+        connect_timeout, read_timeout = crawler.timeout
+        self.client = httpx.AsyncClient(
+            headers=crawler.headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            http2=HTTP2_AVAILABLE
+        )
+        # 合并对同一广播剧、关键词和封面的并发请求
+        self._inflight = AsyncSingleFlight()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get(self, url: str, rate_limiter: Optional[TokenBucket] = None, **kwargs) -> "httpx.Response":
+        """经过限流的 GET 请求（默认使用全局限流器），连接失败、超时和 502/503/504 时按带抖动的指数退避重试"""
+        endpoint = self.crawler.endpoint(url)
+        rate_limiter = rate_limiter or self.rate_limiter
+        for attempt in range(self.retries + 1):
+            with metrics.timer("ratelimit_wait"):
+                await rate_limiter.acquire_async()
+            start = time.perf_counter()
+            try:
+                response = await self.client.get(url, **kwargs)
+            except httpx.TransportError:
+                metrics.observe_http(endpoint, time.perf_counter() - start, "error")
+                rate_limiter.backoff()
+                if attempt == self.retries:
+                    raise
+            else:
+                metrics.observe_http(endpoint, time.perf_counter() - start, response.status_code)
+                metrics.add_bytes(endpoint, len(response.content))
+                rate_limiter.on_response(
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After"))
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+            await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt + random.uniform(0, RETRY_BACKOFF_JITTER))
+
+    async def get_drama_info(self, drama_id: int) -> Optional[Dict]:
+        """获取广播剧信息（getdrama 接口的 info 字段），优先读取缓存"""
+        drama_info = await asyncio.to_thread(self.crawler.cached_drama_info, drama_id)
+        if drama_info is not None:
+            return drama_info
+        return await self._inflight.do(("drama", drama_id), self._load_drama_info, drama_id)
+
+    async def _load_drama_info(self, drama_id: int) -> Optional[Dict]:
+        url = f"{self.crawler.drama_api_url}/getdrama?drama_id={drama_id}"
+        try:
+            response = await self.get(url)
+            response.raise_for_status()
+            data = response.json()
+
+            if data["success"] and isinstance(data.get("info"), dict):
+                drama_info = data["info"]
+                await asyncio.to_thread(self.crawler.store_drama_info, drama_id, drama_info)
+                return drama_info
+            return None
+        except Exception as e:
+            print(f"获取广播剧 {drama_id} 信息时出错: {str(e)}")
+            return None
+
+    async def get_drama_sounds(self, drama_id: int) -> List[Dict]:
+        """获取广播剧的所有付费分集"""
+        drama_info = await self.get_drama_info(drama_id)
+        if not drama_info:
+            return []
+        return self.crawler.paid_episodes(drama_info)
+
+    async def search_drama(self, keyword: str) -> List[Dict]:
+        """搜索广播剧，缓存规则与 MissEvanCrawler.search_drama 相同"""
+        key = normalize_keyword(keyword)
+        cached = await asyncio.to_thread(self.crawler.cached_search, key)
+        if cached is not None:
+            return cached
+        return list(await self._inflight.do(("search", key), self._search_drama, keyword, key))
+
+    async def _search_drama(self, keyword: str, key: str) -> List[Dict]:
+        url = self.crawler.search_api_url
+        params = {"s": keyword, "page": 1, "type": "drama", "order": "1"}
+        try:
+            response = await self.get(url, params=params)
+            response.raise_for_status()
+            parsed = self.crawler.parse_search_response(response.json())
+            if parsed is None:
+                return []
+            items, complete = parsed
+
+            # 并发获取各结果的分集信息，并发数由限流器控制
+            episode_lists = await asyncio.gather(*(self.get_drama_sounds(item['id']) for item in items))
+            results = self.crawler.format_search_results(items, list(episode_lists))
+        except Exception as e:
+            print(f"搜索广播剧时出错: {str(e)}")
+            return []
+
+        self.crawler.store_search(key, results, complete)
+        return results
+
+    async def get_cover_thumbnail(self, drama_id: int, size: int = THUMBNAIL_SIZE) -> Optional[Tuple[bytes, str]]:
+        """获取广播剧封面的缩略图，返回 (图片数据, Content-Type)，找不到封面时返回 None"""
+        cached = await asyncio.to_thread(self.crawler.cached_cover, drama_id, size)
+        if cached is not None:
+            return cached
+        return await self._inflight.do(("cover", drama_id, size), self._load_cover_thumbnail, drama_id, size)
+
+    async def _load_cover_thumbnail(self, drama_id: int, size: int) -> Optional[Tuple[bytes, str]]:
+        cover_url = (self.crawler.drama_index.get(drama_id) or {}).get("cover")
+        if not cover_url:
+            cover_url = self.crawler.drama_cover_url(await self.get_drama_info(drama_id))
+        if not cover_url:
+            return None
+
+        try:
+            response = await self.get(cover_url, rate_limiter=self.crawler.cover_rate_limiter)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"获取广播剧 {drama_id} 的封面失败: {e}")
+            return None
+        if not response.content:
+            return None
+
+        # 缩放图片占用 CPU，放到线程中执行，不阻塞事件循环
+        thumbnail, content_type = await asyncio.to_thread(make_thumbnail, response.content, size)
+        await asyncio.to_thread(self.crawler.store_cover, drama_id, size, thumbnail)
+        return thumbnail, content_type
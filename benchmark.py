@@ -0,0 +1,185 @@
+"""基于本地模拟接口的基准测试
+
+测量 MissEvanCrawler 的端到端统计吞吐量、单个分集的弹幕解析耗时、峰值内存和搜索延迟，
+结果保存为 JSON，便于比较不同版本或不同配置。
+
+用法：python benchmark.py --episodes 50 --comments 20000 --latency 0.05 --output result.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Dict, List
+
+from crawler import MissEvanCrawler, iter_danmaku_elements
+from mock_missevan import MockMissEvan
+from userset import UserIdSet
+
+# 默认的结果保存目录
+DEFAULT_RESULTS_DIR = 'benchmark-results'
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _summary(values: List[float]) -> Dict:
+    """耗时列表（秒）的统计摘要（毫秒）"""
+    return {
+        'count': len(values),
+        'mean_ms': statistics.mean(values) * 1000,
+        'p50_ms': _percentile(values, 0.5) * 1000,
+        'p95_ms': _percentile(values, 0.95) * 1000,
+        'max_ms': max(values) * 1000
+    }
+
+
+def _peak_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError:  # Windows 没有 resource 模块
+        return 0
+    # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if platform.system() == 'Darwin' else rss * 1024
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def bench_parse(mock: MockMissEvan, sound_ids: List[int]) -> Dict:
+    """不经过网络，只测量弹幕XML的解析耗时"""
+    durations = []
+    comments = 0
+    for sound_id in sound_ids:
+        body = mock.danmaku_xml(sound_id)
+        chunks = [body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024)]
+        start = time.perf_counter()
+        user_ids = set()
+        for p, _ in iter_danmaku_elements(chunks):
+            user_ids.add(int(p.split(',')[6]))
+            comments += 1
+        durations.append(time.perf_counter() - start)
+    result = _summary(durations)
+    result['comments_per_second'] = comments / sum(durations)
+    return result
+
+
+def _crawl_all(mock: MockMissEvan, args) -> int:
+    """统计所有模拟广播剧的不重复弹幕用户数"""
+    # 每次使用新的爬虫实例（不带磁盘缓存），避免命中上一次的结果
+    crawler = MissEvanCrawler(requests_per_second=args.rps, burst=args.rps, base_url=mock.base_url)
+    total = UserIdSet()
+    for drama_id in mock.drama_ids:
+        episodes = crawler.get_drama_sounds(drama_id)
+        for _, _, user_ids, _ in crawler.iter_episode_danmaku(episodes, max_workers=args.workers):
+            total.update(user_ids)
+    return len(total)
+
+
+def bench_crawl(mock: MockMissEvan, args) -> Dict:
+    """端到端统计：从获取分集列表到合并所有分集的不重复用户"""
+    # 预先生成弹幕XML，计时只包括抓取和解析
+    for drama_id in mock.drama_ids:
+        for sound_id in mock.paid_sound_ids(drama_id):
+            mock.danmaku_xml(sound_id)
+
+    durations = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        unique_users = _crawl_all(mock, args)
+        durations.append(time.perf_counter() - start)
+
+    # tracemalloc 会明显拖慢执行，单独运行一次测量峰值内存
+    tracemalloc.start()
+    _crawl_all(mock, args)
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    episodes = mock.dramas * mock.episodes
+    best = min(durations)
+    return {
+        'seconds': _summary(durations),
+        'episodes_per_second': episodes / best,
+        'comments_per_second': episodes * mock.comments / best,
+        'unique_users': unique_users,
+        'peak_traced_bytes': peak_traced,
+        'peak_rss_bytes': _peak_rss_bytes()
+    }
+
+
+def bench_search(mock: MockMissEvan, args) -> Dict:
+    """搜索延迟：首次搜索（请求上游）和重复搜索（命中缓存）"""
+    crawler = MissEvanCrawler(requests_per_second=args.rps, burst=args.rps, base_url=mock.base_url)
+    cold, warm = [], []
+    for i in range(args.searches):
+        keyword = f"模拟广播剧{mock.drama_ids[i % mock.dramas]}"
+        for durations in (cold, warm):
+            start = time.perf_counter()
+            crawler.search_drama(keyword)
+            durations.append(time.perf_counter() - start)
+        # 下一轮的首次搜索也要请求上游（包括检查各结果的分集）
+        crawler.search_cache.clear()
+        crawler._drama_memo.clear()
+    return {'cold': _summary(cold), 'warm': _summary(warm)}
+
+
+def run(args) -> Dict:
+    mock = MockMissEvan(dramas=args.dramas, episodes=args.episodes, comments=args.comments,
+                        users=args.users, latency=args.latency, seed=args.seed)
+    with mock:
+        results = {
+            'parse': bench_parse(mock, mock.paid_sound_ids(mock.drama_ids[0])),
+            'crawl': bench_crawl(mock, args),
+            'search': bench_search(mock, args),
+            'requests': dict(mock.requests)
+        }
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MissEvanCrawler 基准测试（使用本地模拟接口）")
+    parser.add_argument("--dramas", type=int, default=2)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--comments", type=int, default=5000, help="每个分集的弹幕数")
+    parser.add_argument("--users", type=int, default=20000, help="用户ID的取值范围")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟接口每个请求的延迟（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="分集并发抓取的线程数")
+    parser.add_argument("--rps", type=float, default=1000.0, help="限流器的每秒请求数")
+    parser.add_argument("--repeat", type=int, default=3, help="端到端统计的重复次数")
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果文件路径，默认保存到 benchmark-results/ 下")
+    args = parser.parse_args()
+    output = args.output
+    del args.output
+
+    report = run(args)
+    if not output:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report['results'], ensure_ascii=False, indent=2))
+    print(f"结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import metrics
+
+# 缓存文件默认位置，可通过环境变量覆盖
+DEFAULT_CACHE_PATH = os.environ.get('MISSEVAN_CACHE_PATH', 'missevan_cache.sqlite3')
+# 缓存总大小上限（字节），超出后按最近访问时间淘汰
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get('MISSEVAN_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+class DiskCache:
+    """基于 SQLite 的持久化键值缓存
+
+    每条记录可设置过期时间（TTL），总大小超过上限时淘汰最久未访问的记录（LRU）。
+    值可以是 bytes（原样保存）或任意可 JSON 序列化的对象。
+    总大小由触发器在每次增删时维护在 cache_meta 表中，写入时不必扫描全表；
+    淘汰和过期清理只读索引，不会读到保存值的溢出页。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 name: str = "disk"):
+        self.path = path
+        self.name = name  # 指标中的缓存名
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # INSERT OR REPLACE 替换旧记录时也要触发删除触发器，总大小才准确
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        # 建表和初始化总大小放在同一个事务中，多个进程同时打开旧的缓存文件时只初始化一次
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " is_json INTEGER NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            # 淘汰时按访问时间顺序读取 key 和 size，由覆盖索引直接提供（取代旧的 accessed_at 索引）
+            self._conn.execute("DROP INDEX IF EXISTS cache_accessed_at")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache(accessed_at, key, size)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache(expires_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO cache_meta (name, value)"
+                " SELECT 'total_size', COALESCE(SUM(size), 0) FROM cache"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache BEGIN"
+                " UPDATE cache_meta SET value = value + NEW.size WHERE name = 'total_size'; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache BEGIN"
+                " UPDATE cache_meta SET value = value - OLD.size WHERE name = 'total_size'; END"
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """读取缓存，不存在或已过期时返回 default"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, is_json, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                metrics.cache_lookup(self.name, False)
+                return default
+            value, is_json, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                metrics.cache_lookup(self.name, False)
+                return default
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        metrics.cache_lookup(self.name, True)
+        return json.loads(value) if is_json else bytes(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl 为秒数，None 表示不过期"""
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            blob, is_json = bytes(value), 0
+        else:
+            blob, is_json = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 1
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, is_json, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, is_json, len(blob), expires_at, now)
+            )
+            self._evict(now)
+
+    def delete(self, key: str):
+        """删除一条缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def total_size(self) -> int:
+        """缓存中所有值的总字节数"""
+        with self._lock:
+            return self._total_size()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT value FROM cache_meta WHERE name = 'total_size'").fetchone()[0]
+
+    def _evict(self, now: float):
+        """超出大小上限时先删除过期记录，仍然超出再按最近访问时间淘汰"""
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache INDEXED BY cache_lru ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+
+
+class MemoryCache:
+    """进程内的 LRU 缓存，每条记录有过期时间（线程安全）"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300, name: str = "memory"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name  # 指标中的缓存名
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """读取缓存，不存在或已过期时返回 default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                metrics.cache_lookup(self.name, False)
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                metrics.cache_lookup(self.name, False)
+                return default
+            self._data.move_to_end(key)
+        metrics.cache_lookup(self.name, True)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl 为 None 时使用默认过期时间"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Any):
+        """删除一条缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
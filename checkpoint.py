@@ -0,0 +1,63 @@
+import base64
+import os
+import time
+from typing import Optional, Set, Tuple, TypeVar
+
+from cache import DiskCache
+
+# 检查点保存间隔（完成的分集数 / 秒数，满足其一即保存）和保留时间（秒）
+CHECKPOINT_EVERY = 5
+CHECKPOINT_INTERVAL = 10
+CHECKPOINT_TTL = int(os.environ.get('CHECKPOINT_TTL', 3600))
+
+# 部分聚合结果：UserIdSet 或 HyperLogLog，两者都支持 to_bytes / from_bytes
+Aggregate = TypeVar('Aggregate')
+
+
+class CrawlCheckpoint:
+    """爬取任务的检查点
+
+    定期把已完成的分集和部分聚合结果保存到本地缓存，进程重启或重新提交任务后
+    可以从检查点继续，不必重新抓取已完成的分集。cache 为 None 时不做任何事。
+    """
+
+    def __init__(self, cache: Optional[DiskCache], key: str):
+        self.cache = cache
+        self.key = f"checkpoint:{key}"
+        self.completed: Set[int] = set()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def load(self, aggregate: Aggregate) -> Tuple[Set[int], Aggregate]:
+        """读取检查点，返回 (已完成的 sound_id 集合, 部分聚合结果)；没有检查点时原样返回 aggregate"""
+        state = self.cache.get(self.key) if self.cache is not None else None
+        if state:
+            try:
+                aggregate = type(aggregate).from_bytes(base64.b64decode(state["aggregate"]))
+                self.completed = set(state["completed"])
+            except (KeyError, ValueError) as e:
+                print(f"读取检查点 {self.key} 时出错: {str(e)}")
+        return set(self.completed), aggregate
+
+    def record(self, sound_id: int, aggregate: Aggregate):
+        """记录一个分集已完成，必要时保存检查点"""
+        self.completed.add(sound_id)
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY or time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            self.save(aggregate)
+
+    def save(self, aggregate: Aggregate):
+        """立即保存检查点"""
+        if self.cache is None:
+            return
+        self.cache.set(self.key, {
+            "completed": sorted(self.completed),
+            "aggregate": base64.b64encode(aggregate.to_bytes()).decode('ascii')
+        }, ttl=CHECKPOINT_TTL)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def clear(self):
+        """任务完成后删除检查点"""
+        if self.cache is not None:
+            self.cache.delete(self.key)
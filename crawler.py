@@ -1,39 +1,226 @@
 import requests
 import json
+import random
+import struct
 import time
-from typing import Dict, List, Optional, Set
+from urllib.parse import urlparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+from ratelimit import TokenBucket, parse_retry_after
+from cache import DiskCache, MemoryCache
+from userset import UserIdSet
+from hll import HyperLogLog
+from singleflight import SingleFlight
+from stats import EpisodeStats
+from export import DanmakuExportWriter
+from thumbnail import THUMBNAIL_SIZE, image_content_type, make_thumbnail
+import metrics
+from search_index import DramaIndex, normalize_keyword
+
+# 并发抓取分集弹幕时的默认线程数，以及所有请求共享的每秒请求数上限
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+# 限流器允许的瞬时突发请求数（长期平均速率仍不超过上限），便于搜索时并发检查多个结果
+DEFAULT_BURST = 8
+# 搜索时并发检查各结果是否有付费分集的线程数
+SEARCH_MAX_WORKERS = 8
+# 封面图片在单独的图片服务器上，使用独立的限流器，不占用接口的请求配额
+DEFAULT_COVER_REQUESTS_PER_SECOND = 20.0
+
+# 缓存有效期（秒）：广播剧分集信息变化较少，弹幕会持续增加
+DRAMA_CACHE_TTL = 6 * 3600
+DANMAKU_CACHE_TTL = 3600
+# 分集弹幕增量状态（水位线和已收集的用户）的保留时间，过期前重新抓取时只合并新弹幕
+DANMAKU_STATE_TTL = 30 * 24 * 3600
+# 进程内广播剧信息缓存的条数和有效期，搜索后紧接着开始统计时可直接复用
+DRAMA_MEMO_SIZE = 512
+DRAMA_MEMO_TTL = 600
+# 搜索结果缓存：条数、有结果时的有效期、没有结果时的有效期
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 300
+SEARCH_NEGATIVE_CACHE_TTL = 60
+# 封面缩略图的缓存有效期（秒），封面很少更换
+COVER_CACHE_TTL = 7 * 24 * 3600
+
+# 猫耳FM站点地址，测试和基准测试时可指向本地模拟服务
+DEFAULT_BASE_URL = "https://www.missevan.com"
+# 流式下载弹幕XML时每次读取的字节数
+DANMAKU_CHUNK_SIZE = 64 * 1024
+
+# 连接和读取超时（秒），避免卡住的请求一直占用抓取线程
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+# 连接失败、读取超时和 502/503/504 的自动重试次数，以及指数退避的基数和随机抖动（秒）
+# 429 不在此重试，交给限流器根据 Retry-After 降低整体速率
+# 只有建立连接失败（请求没有到达上游）由 urllib3 重试，其余重试在 MissEvanCrawler.get 中
+# 进行，每次重试都经过限流器，上游的 5xx 也会让限流器退避
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_BACKOFF_JITTER = 0.5
+RETRY_STATUSES = (502, 503, 504)
+
+try:
+    import brotli  # noqa: F401  安装了 brotli 时 urllib3 可以解码 br 压缩的响应
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+def build_retry(retries: int) -> Retry:
+    """urllib3 的重试策略：只重试建立连接失败，退避时间带随机抖动
+
+    读取失败（超时、连接被断开）和 502/503/504 不在这里重试，否则重试请求会绕过限流器。
+    """
+    options = dict(total=retries, connect=retries, read=0, status=0,
+                   allowed_methods=frozenset({"GET", "HEAD"}),
+                   backoff_factor=RETRY_BACKOFF_FACTOR, raise_on_status=False)
+    try:
+        return Retry(backoff_jitter=RETRY_BACKOFF_JITTER, **options)
+    except TypeError:  # urllib3 1.x 不支持 backoff_jitter
+        return Retry(**options)
+
+
+def is_connect_failure(error: requests.exceptions.RequestException) -> bool:
+    """是否是建立连接失败（请求没有发出），这类错误已由 urllib3 重试过"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def pack_danmaku_state(state: Dict, user_ids: UserIdSet) -> bytes:
+    """把分集弹幕状态打包为 bytes：4 字节的头长度、JSON 头（水位线等）、用户ID的原始 int64 字节"""
+    header = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return struct.pack('<I', len(header)) + header + user_ids.to_bytes()
+
+
+def unpack_danmaku_state(data) -> Tuple[Dict, UserIdSet]:
+    """还原 pack_danmaku_state 的结果，返回 (状态, 用户ID集合)；兼容旧版以 JSON 列表保存的状态"""
+    if isinstance(data, dict):
+        return data, UserIdSet.from_sorted(data["user_ids"])
+    size = struct.unpack_from('<I', data)[0]
+    return json.loads(data[4:4 + size]), UserIdSet.from_bytes(data[4 + size:])
+
+
+def iter_danmaku_elements(chunks: Iterable[bytes]) -> Iterator[Tuple[str, str]]:
+    """增量解析弹幕XML，逐条返回 <d> 元素的 (p 属性, 弹幕文本)
+
+    每个元素处理完立即从树上移除，峰值内存与弹幕总数无关。
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "d":
+                p = elem.get("p")
+                if p is not None:
+                    yield p, elem.text or ""
+                # 已解析完的兄弟元素都可以丢弃
+                root.clear()
+    parser.close()
+
 
 class MissEvanCrawler:
-    def __init__(self):
-        self.base_url = "https://www.missevan.com"
-        self.api_url = "https://www.missevan.com/sound"
-        self.drama_api_url = "https://www.missevan.com/dramaapi"
-        self.search_api_url = "https://www.missevan.com/dramaapi/search"
-        self.episode_api_url = "https://www.missevan.com/dramaapi/getepisode"
-        self.danmaku_api_url = "https://www.missevan.com/dramaapi/getdanmaku"
+    def __init__(self, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+                 cache: Optional[DiskCache] = None, burst: float = DEFAULT_BURST,
+                 base_url: str = DEFAULT_BASE_URL, pool_size: Optional[int] = None,
+                 timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 retries: int = DEFAULT_RETRIES,
+                 cover_requests_per_second: float = DEFAULT_COVER_REQUESTS_PER_SECOND):
+        self.base_url = base_url.rstrip("/")
+        self.api_url = f"{self.base_url}/sound"
+        self.drama_api_url = f"{self.base_url}/dramaapi"
+        self.search_api_url = f"{self.base_url}/dramaapi/search"
+        self.episode_api_url = f"{self.base_url}/dramaapi/getepisode"
+        self.danmaku_api_url = f"{self.base_url}/dramaapi/getdanmaku"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Accept": "application/json, text/plain, */*",
             "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "Connection": "keep-alive",
             "Referer": "https://www.missevan.com/mdrama",
             "Origin": "https://www.missevan.com"
         }
         self.session = requests.Session()
         self.session.headers.update(self.headers)
-        self.drama_cache = {}
-        self.episode_cache = {}
-        self.danmaku_cache = {}
+        # 连接池按并发线程数设置（默认够一个统计任务和一次搜索同时使用），避免连接被反复建立和丢弃
+        self.timeout = timeout
+        pool_size = pool_size or DEFAULT_MAX_WORKERS + SEARCH_MAX_WORKERS
+        self.retries = retries
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False,
+                              max_retries=build_retry(retries))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 广播剧信息和分集弹幕用户的持久化缓存，为 None 时不缓存
+        self.cache = cache
+        self._drama_memo = MemoryCache(max_entries=DRAMA_MEMO_SIZE, ttl=DRAMA_MEMO_TTL, name="drama_memo")
+        # 搜索结果缓存，以及搜索和统计过程中见过的广播剧索引
+        self.search_cache = MemoryCache(max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, name="search")
+        self.drama_index = DramaIndex()
         self.progress_callbacks = {}
         self.running_tasks = {}
+        # 所有线程共享的限流器，遇到 429/5xx 时自动退避
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=burst)
+        self.cover_rate_limiter = TokenBucket(cover_requests_per_second)
+        # 合并对同一广播剧/分集的并发抓取
+        self._inflight = SingleFlight()
+
+    def get(self, url: str, rate_limiter: Optional[TokenBucket] = None, **kwargs) -> requests.Response:
+        """经过限流的 GET 请求（默认使用全局限流器），并根据响应状态调整请求速率
+
+        读取超时、连接在响应前被断开和 502/503/504 时按带抖动的指数退避重试，每次重试都重新经过限流器。
+        记录限流等待时间、请求耗时和下载字节数（流式请求的字节数由读取方记录）。
+        """
+        endpoint = self.endpoint(url)
+        rate_limiter = rate_limiter or self.rate_limiter
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            with metrics.timer("ratelimit_wait"):
+                rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.observe_http(endpoint, time.perf_counter() - start, "error")
+                rate_limiter.backoff()
+                # 建立连接失败已由 urllib3 重试过，这里只重试请求发出后的失败
+                if is_connect_failure(e) or attempt == self.retries:
+                    raise
+            else:
+                metrics.observe_http(endpoint, time.perf_counter() - start, response.status_code)
+                if not kwargs.get("stream"):
+                    metrics.add_bytes(endpoint, len(response.content))
+                rate_limiter.on_response(
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After"))
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                response.close()
+            time.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt + random.uniform(0, RETRY_BACKOFF_JITTER))
+
+    def endpoint(self, url: str) -> str:
+        """指标中的接口名：本站接口取路径，其他地址（如封面图片）只取域名"""
+        parsed = urlparse(url)
+        if url.startswith(self.base_url):
+            return parsed.path
+        return parsed.netloc
 
     def get_sound_info(self, sound_id: int) -> Optional[Dict]:
         """获取声音详细信息"""
         url = f"{self.api_url}/getsound?soundid={sound_id}"
         try:
-            response = self.session.get(url)
+            response = self.get(url)
             response.raise_for_status()
             data = response.json()
             
@@ -47,92 +234,480 @@ class MissEvanCrawler:
                 print(f"响应内容: {e.response.text}")
             return None
 
-    def get_danmaku_ids(self, sound_id: int) -> Set[int]:
-        """获取一个声音的所有弹幕用户ID"""
+    def get_danmaku_ids(self, sound_id: int, incremental: bool = True) -> UserIdSet:
+        """获取一个声音的所有弹幕用户ID
+
+        缓存中保存了上次抓取时的弹幕ID/发送时间水位线和用户集合。
+        缓存过期后重新抓取时，incremental 为 True 则只合并水位线之后的新弹幕，
+        为 False 则重新统计全部弹幕。
+        """
+        return self._get_danmaku_ids(sound_id, incremental)[0]
+
+    def _get_danmaku_ids(self, sound_id: int, incremental: bool) -> Tuple[UserIdSet, bool]:
+        """返回 (用户ID集合, 是否为最新数据)，抓取失败时返回上次的结果或空集合
+
+        同一分集同时只会抓取一次，并发调用者共享同一个结果，调用方不应修改返回的集合。
+        """
+        return self._inflight.do(("danmaku", sound_id, incremental),
+                                 self._load_danmaku_ids, sound_id, incremental)
+
+    def _load_danmaku_ids(self, sound_id: int, incremental: bool) -> Tuple[UserIdSet, bool]:
+        cache_key = f"danmaku:{sound_id}"
+        cached = self.cache.get(cache_key) if self.cache is not None else None
+        state, cached_ids = unpack_danmaku_state(cached) if cached is not None else (None, UserIdSet())
+        if state is not None and time.time() - state["fetched_at"] < DANMAKU_CACHE_TTL:
+            return cached_ids, True
+        
+        if not incremental:
+            state, cached_ids = None, UserIdSet()
+        # 带上次响应的 ETag/Last-Modified 做条件请求，弹幕没有变化时服务器返回 304，不必重新下载
+        validators = {"etag": state.get("etag"), "last_modified": state.get("last_modified")} if state else {}
         try:
-            # 使用网页版评论API
-            url = f"https://www.missevan.com/sound/getdm?soundid={sound_id}"
-            response = self.session.get(url)
-            response.raise_for_status()  # 检查HTTP错误
-            
-            # 解析XML格式的弹幕数据
-            root = ET.fromstring(response.text)
-            user_ids = set()
-            
-            # 遍历所有弹幕
-            for d in root.findall('.//d'):
-                try:
-                    # 弹幕属性格式：p="时间,模式,字体大小,颜色,发送时间,弹幕池,用户ID,弹幕ID"
-                    attrs = d.get('p').split(',')
-                    if len(attrs) >= 7:
-                        user_id = int(attrs[6])
-                        user_ids.add(user_id)
-                except (ValueError, IndexError) as e:
-                    print(f"解析弹幕属性时出错: {str(e)}")
-                    continue
-            
-            return user_ids
-            
+            user_ids, max_id, max_time = self._fetch_danmaku_ids(
+                sound_id,
+                after_id=state["max_id"] if state else None,
+                after_time=state["max_time"] if state else None,
+                validators=validators
+            )
         except requests.exceptions.RequestException as e:
             print(f"获取sound {sound_id}的弹幕时出错: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"响应状态码: {e.response.status_code}")
                 print(f"响应内容: {e.response.text}")
-            return set()
+            return cached_ids, False
         except ET.ParseError as e:
             print(f"解析XML数据时出错: {str(e)}")
-            return set()
+            return cached_ids, False
         except Exception as e:
             print(f"处理弹幕数据时出错: {str(e)}")
-            return set()
+            return cached_ids, False
+        
+        if state:
+            # 把水位线之后的新用户合并进已有集合
+            user_ids.update(cached_ids)
+            max_id = max(max_id, state["max_id"])
+            max_time = max(max_time, state["max_time"])
+        
+        # 只缓存成功获取的结果
+        if self.cache is not None:
+            self.cache.set(cache_key, pack_danmaku_state({
+                "fetched_at": time.time(),
+                "max_id": max_id,
+                "max_time": max_time,
+                "etag": validators.get("etag"),
+                "last_modified": validators.get("last_modified")
+            }, user_ids), ttl=DANMAKU_STATE_TTL)
+        return user_ids, True
 
-    def get_drama_sounds(self, drama_id: int) -> List[Dict]:
-        """获取广播剧的所有分集信息"""
+    def get_danmaku_sketch(self, sound_id: int, precision: int, incremental: bool = True) -> HyperLogLog:
+        """获取一个声音弹幕用户的 HyperLogLog 估计器，按分集缓存以便跨分集、跨广播剧合并"""
+        return self._get_danmaku_sketch(sound_id, precision, incremental)[0]
+
+    def _get_danmaku_sketch(self, sound_id: int, precision: int, incremental: bool) -> Tuple[HyperLogLog, bool]:
+        """返回 (HyperLogLog 估计器, 是否为最新数据)"""
+        cache_key = f"hll:{sound_id}:{precision}"
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return HyperLogLog.from_bytes(cached), True
+        
+        user_ids, fresh = self._get_danmaku_ids(sound_id, incremental)
+        sketch = HyperLogLog(precision)
+        sketch.update(user_ids)
+        # 抓取失败时不缓存，避免把不完整的结果保存下来
+        if self.cache is not None and fresh:
+            self.cache.set(cache_key, sketch.to_bytes(), ttl=DANMAKU_CACHE_TTL)
+        return sketch, fresh
+
+    def _iter_danmaku(self, sound_id: int,
+                      validators: Optional[Dict] = None) -> Iterator[Tuple[float, int, int, int, str]]:
+        """流式下载并解析一个声音的弹幕，逐条返回 (视频中的秒数, 发送时间, 用户ID, 弹幕ID, 弹幕文本)
+
+        没有弹幕ID的旧格式弹幕，弹幕ID为 0；格式错误的弹幕会被跳过，请求出错时抛出异常。
+        validators 为 {"etag", "last_modified"} 时发送条件请求：未变化（304）时不返回任何弹幕并
+        设置 validators["not_modified"]，否则把响应的 ETag/Last-Modified 写回 validators。
+        """
+        # 使用网页版评论API，流式下载并边下载边解析
+        url = f"{self.api_url}/getdm?soundid={sound_id}"
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        with self.get(url, stream=True, headers=headers) as response:
+            if validators is not None:
+                validators["not_modified"] = response.status_code == 304
+                if validators["not_modified"]:
+                    return
+                validators["etag"] = response.headers.get("ETag")
+                validators["last_modified"] = response.headers.get("Last-Modified")
+            response.raise_for_status()  # 检查HTTP错误
+            # 等待网络数据的时间记为 download，其余时间（解析和调用方逐条处理）记为 parse
+            download = [0.0]
+            comments = 0
+            start = time.perf_counter()
+            try:
+                chunks = self._read_chunks(response, "/sound/getdm", download)
+                # 弹幕属性格式：p="时间,模式,字体大小,颜色,发送时间,弹幕池,用户ID,弹幕ID"
+                for p, text in iter_danmaku_elements(chunks):
+                    try:
+                        attrs = p.split(',')
+                        danmaku_id = int(attrs[7]) if len(attrs) >= 8 else 0
+                        item = float(attrs[0]), int(attrs[4]), int(attrs[6]), danmaku_id, text
+                    except (ValueError, IndexError) as e:
+                        print(f"解析弹幕属性时出错: {str(e)}")
+                        continue
+                    comments += 1
+                    yield item
+            finally:
+                metrics.observe_stage("download", download[0])
+                metrics.observe_stage("parse", time.perf_counter() - start - download[0])
+                metrics.add_comments(comments)
+
+    @staticmethod
+    def _read_chunks(response: requests.Response, endpoint: str, download: List[float]) -> Iterator[bytes]:
+        """逐块读取流式响应，累计等待时间到 download[0] 并记录下载字节数"""
+        chunks = response.iter_content(chunk_size=DANMAKU_CHUNK_SIZE)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            download[0] += time.perf_counter() - start
+            if chunk is None:
+                return
+            metrics.add_bytes(endpoint, len(chunk))
+            yield chunk
+
+    def _fetch_danmaku_ids(self, sound_id: int, after_id: Optional[int] = None,
+                           after_time: Optional[int] = None,
+                           validators: Optional[Dict] = None) -> Tuple[UserIdSet, int, int]:
+        """从接口下载并解析弹幕用户ID，出错时抛出异常
+
+        只统计弹幕ID大于 after_id（没有弹幕ID时按发送时间晚于 after_time）的弹幕，
+        返回 (用户ID集合, 最大弹幕ID, 最大发送时间)；validators 的含义同 _iter_danmaku。
+        """
+        user_ids = set()
+        max_id = after_id or 0
+        max_time = after_time or 0
+        for _, send_time, user_id, danmaku_id, _ in self._iter_danmaku(sound_id, validators):
+            # 跳过水位线之前已经统计过的弹幕
+            if danmaku_id:
+                if after_id is not None and danmaku_id <= after_id:
+                    continue
+            elif after_time is not None and send_time <= after_time:
+                continue
+            user_ids.add(user_id)
+            max_id = max(max_id, danmaku_id)
+            max_time = max(max_time, send_time)
+        
+        return UserIdSet.from_sorted(sorted(user_ids)), max_id, max_time
+
+    def get_danmaku_stats(self, sound_id: int) -> EpisodeStats:
+        """获取一个声音的弹幕统计（弹幕数、视频时间热力图、每个用户的弹幕数）
+
+        需要全部弹幕，因此总是完整抓取一遍；同时刷新用户ID缓存和水位线，
+        之后的去重计数可以直接使用。抓取失败时只包含上次缓存的用户ID，且不会被缓存。
+        """
+        return self._get_danmaku_stats(sound_id)[0]
+
+    def _get_danmaku_stats(self, sound_id: int) -> Tuple[EpisodeStats, bool]:
+        """返回 (弹幕统计, 是否为最新数据)"""
+        return self._inflight.do(("stats", sound_id), self._load_danmaku_stats, sound_id)
+
+    def _load_danmaku_stats(self, sound_id: int) -> Tuple[EpisodeStats, bool]:
+        cache_key = f"stats:{sound_id}"
+        cached = self.cache.get(cache_key) if self.cache is not None else None
+        if cached is not None:
+            # 旧版本以 JSON 字典缓存统计
+            stats = EpisodeStats.from_dict(cached) if isinstance(cached, dict) else EpisodeStats.from_bytes(cached)
+            return stats, True
+        
+        stats = EpisodeStats()
+        max_id = max_time = 0
+        validators = {}
+        try:
+            for stime, send_time, user_id, danmaku_id, _ in self._iter_danmaku(sound_id, validators):
+                stats.add(stime, user_id)
+                max_id = max(max_id, danmaku_id)
+                max_time = max(max_time, send_time)
+        except (requests.exceptions.RequestException, ET.ParseError) as e:
+            print(f"统计sound {sound_id}的弹幕时出错: {str(e)}")
+            stats = EpisodeStats()
+            stats.user_ids = self._get_danmaku_ids(sound_id, True)[0]
+            return stats, False
+        stats.finish()
+        
+        if self.cache is not None:
+            now = time.time()
+            self.cache.set(cache_key, stats.to_bytes(), ttl=DANMAKU_CACHE_TTL)
+            self.cache.set(f"danmaku:{sound_id}", pack_danmaku_state({
+                "fetched_at": now,
+                "max_id": max_id,
+                "max_time": max_time,
+                "etag": validators.get("etag"),
+                "last_modified": validators.get("last_modified")
+            }, stats.user_ids), ttl=DANMAKU_STATE_TTL)
+        return stats, True
+
+    def _fetch_danmaku_columns(self, sound_id: int, with_text: bool = False) -> Dict:
+        """抓取一个声音的全部弹幕并按列保存，用于导出"""
+        columns = DanmakuExportWriter.new_columns(with_text)
+        sound_ids, stimes, send_times = columns['sound_id'], columns['stime'], columns['send_time']
+        user_ids, danmaku_ids = columns['user_id'], columns['danmaku_id']
+        for stime, send_time, user_id, danmaku_id, text in self._iter_danmaku(sound_id):
+            sound_ids.append(sound_id)
+            stimes.append(stime)
+            send_times.append(send_time)
+            user_ids.append(user_id)
+            danmaku_ids.append(danmaku_id)
+            if with_text:
+                columns['text'].append(text)
+        return columns
+
+    def export_danmaku(self, episodes: List[Dict], path: str, fmt: str = 'npy',
+                       with_text: bool = False, max_workers: int = DEFAULT_MAX_WORKERS,
+                       on_episode: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """抓取多个分集的全部弹幕，按列导出到 path，返回导出信息
+
+        fmt 为 npy 时 path 是目录，每列一个可内存映射的 .npy 文件；为 parquet 时 path 是文件
+        （需要 pyarrow）。各分集并发抓取，由写入线程按完成顺序追加；抓取失败的分集
+        记录在返回值的 failed 中。on_episode 的含义同 crawl_dramas。
+        """
+        writer = DanmakuExportWriter(path, fmt, with_text)
+        failed = []
+        episodes = [episode for episode in episodes if episode.get("sound_id")]
+        remaining = iter(episodes)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        futures = {}
+
+        def submit_next():
+            episode = next(remaining, None)
+            if episode is not None:
+                futures[metrics.submit(executor, self._fetch_danmaku_columns,
+                                       episode["sound_id"], with_text)] = episode
+
+        try:
+            # 同时最多抓取 max_workers 个分集，写入一个再提交下一个，
+            # 已抓取未写入的列数据不会堆积，内存与分集总数无关
+            for _ in range(max(1, max_workers)):
+                submit_next()
+            done = 0
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    episode = futures.pop(future)
+                    submit_next()
+                    try:
+                        writer.write(episode["sound_id"], future.result())
+                    except (requests.exceptions.RequestException, ET.ParseError) as e:
+                        print(f"导出sound {episode['sound_id']}的弹幕时出错: {str(e)}")
+                        failed.append(episode["sound_id"])
+                    done += 1
+                    if on_episode is not None:
+                        on_episode(done, len(episodes), episode)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            meta = writer.close()
+        meta['failed'] = failed
+        return meta
+
+    def iter_episode_danmaku(self, episodes: List[Dict],
+                             max_workers: int = DEFAULT_MAX_WORKERS,
+                             incremental: bool = True,
+                             precision: Optional[int] = None,
+                             stats: bool = False
+                             ) -> Iterator[Tuple[int, Dict, Union[UserIdSet, HyperLogLog, EpisodeStats], bool]]:
+        """并发获取多个分集的弹幕用户ID，按完成顺序逐个返回 (序号, 分集信息, 用户ID集合, 是否抓取成功)
+
+        抓取失败的分集返回上次缓存的结果（或空集合），是否抓取成功为 False。
+        指定 precision 时返回各分集的 HyperLogLog 估计器而不是精确集合；
+        stats 为 True 时返回各分集的 EpisodeStats（其 user_ids 即用户ID集合）。
+        请求节奏由实例共享的限流器控制，因此多个并发任务合计也不会超过速率上限。
+        """
+        if stats:
+            fetch, args = self._get_danmaku_stats, ()
+        elif precision is None:
+            fetch, args = self._get_danmaku_ids, (incremental,)
+        else:
+            fetch, args = self._get_danmaku_sketch, (precision, incremental)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            futures = {}
+            for idx, episode in enumerate(episodes, 1):
+                sound_id = episode.get("sound_id")
+                if sound_id:
+                    futures[metrics.submit(executor, fetch, sound_id, *args)] = (idx, episode)
+
+            for future in as_completed(futures):
+                # 取出后不再引用已完成的 future，调用方处理完的分集结果可以及时释放
+                idx, episode = futures.pop(future)
+                yield (idx, episode, *future.result())
+        finally:
+            # 调用方提前停止迭代时，取消尚未开始的请求
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def crawl_dramas(self, drama_ids: List[int],
+                     max_workers: int = DEFAULT_MAX_WORKERS,
+                     incremental: bool = True,
+                     precision: Optional[int] = None,
+                     on_episode: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """批量统计多部广播剧的弹幕用户
+
+        所有广播剧的付费分集合并到同一个并发抓取流程中，多部剧共用的分集只抓取一次。
+        返回每部剧的不重复用户数以及所有剧合计的不重复用户数；指定 precision 时为估算值。
+        抓取失败的分集只合并了上次缓存的结果（或空集合），其数量记在每部剧和合计的 failed_episodes 中。
+        on_episode(已完成数, 分集总数, 分集信息) 在每个分集完成后调用，抛出异常可中止统计。
+        """
+        drama_ids = list(dict.fromkeys(drama_ids))
+        with ThreadPoolExecutor(max_workers=max(1, min(SEARCH_MAX_WORKERS, len(drama_ids)))) as executor:
+            futures = [metrics.submit(executor, self.get_drama_sounds, drama_id) for drama_id in drama_ids]
+            episode_lists = [future.result() for future in futures]
+        
+        def new_total():
+            return HyperLogLog(precision) if precision is not None else UserIdSet()
+        
+        # 按 sound_id 去重，记录每个分集属于哪些广播剧
+        episodes_by_sound = {}
+        dramas_by_sound = {}
+        for drama_id, episodes in zip(drama_ids, episode_lists):
+            for episode in episodes:
+                sound_id = episode.get("sound_id")
+                if sound_id:
+                    episodes_by_sound.setdefault(sound_id, episode)
+                    dramas_by_sound.setdefault(sound_id, []).append(drama_id)
+        
+        drama_totals = {drama_id: new_total() for drama_id in drama_ids}
+        union_total = new_total()
+        failed_by_drama = dict.fromkeys(drama_ids, 0)
+        failed_episodes = 0
+        total_episodes = len(episodes_by_sound)
+        results = self.iter_episode_danmaku(list(episodes_by_sound.values()), max_workers=max_workers,
+                                            incremental=incremental, precision=precision)
+        for done, (idx, episode, danmaku_ids, fetched) in enumerate(results, 1):
+            with metrics.timer("merge"):
+                for drama_id in dramas_by_sound[episode["sound_id"]]:
+                    drama_totals[drama_id].update(danmaku_ids)
+                    if not fetched:
+                        failed_by_drama[drama_id] += 1
+                union_total.update(danmaku_ids)
+            if not fetched:
+                failed_episodes += 1
+            if on_episode is not None:
+                on_episode(done, total_episodes, episode)
+        
+        dramas = []
+        for drama_id, episodes in zip(drama_ids, episode_lists):
+            indexed = self.drama_index.get(drama_id) or {}
+            dramas.append({
+                'drama_id': drama_id,
+                'name': indexed.get('name'),
+                'episodes': len(episodes),
+                'unique_users': len(drama_totals[drama_id]),
+                'failed_episodes': failed_by_drama[drama_id]
+            })
+        result = {
+            'dramas': dramas,
+            'episodes': total_episodes,
+            'unique_users': len(union_total),
+            'failed_episodes': failed_episodes,
+            'approximate': precision is not None
+        }
+        if precision is not None:
+            result['error_bound'] = union_total.error_bound
+        return result
+
+    def get_drama_info(self, drama_id: int) -> Optional[Dict]:
+        """获取广播剧信息（getdrama 接口的 info 字段），优先读取缓存"""
+        return self._inflight.do(("drama", drama_id), self._load_drama_info, drama_id)
+
+    def _load_drama_info(self, drama_id: int) -> Optional[Dict]:
+        drama_info = self.cached_drama_info(drama_id)
+        if drama_info is not None:
+            return drama_info
+        
         url = f"{self.drama_api_url}/getdrama?drama_id={drama_id}"
         try:
-            response = self.session.get(url)
+            response = self.get(url)
             response.raise_for_status()
             data = response.json()
             
-            if data["success"] and "info" in data:
+            if data["success"] and isinstance(data.get("info"), dict):
                 drama_info = data["info"]
-                if isinstance(drama_info, dict):
-                    episodes = drama_info.get("episodes", [])
-                    
-                    # 如果episodes是列表，直接使用
-                    if isinstance(episodes, list):
-                        # 只获取付费的分集（包括小剧场）
-                        paid_episodes = [ep for ep in episodes 
-                                      if isinstance(ep, dict) 
-                                      and ep.get("need_pay") == 1]
-                        return paid_episodes
-                    # 如果episodes是字典，提取所有值
-                    elif isinstance(episodes, dict):
-                        episodes_list = []
-                        for ep_id, ep_data in episodes.items():
-                            if isinstance(ep_data, list) and len(ep_data) > 0:
-                                episodes_list.extend(ep_data)
-                            elif isinstance(ep_data, dict):
-                                episodes_list.append(ep_data)
-                        
-                        # 只获取付费的分集（包括小剧场）
-                        paid_episodes = [ep for ep in episodes_list 
-                                      if isinstance(ep, dict) 
-                                      and ep.get("need_pay") == 1]
-                        return paid_episodes
-            return []
+                self.store_drama_info(drama_id, drama_info)
+                return drama_info
+            return None
         except Exception as e:
             print(f"获取广播剧 {drama_id} 信息时出错: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"响应状态码: {e.response.status_code}")
                 print(f"响应内容: {e.response.text}")
+            return None
+
+    def cached_drama_info(self, drama_id: int) -> Optional[Dict]:
+        """从进程内缓存或磁盘缓存读取广播剧信息"""
+        drama_info = self._drama_memo.get(drama_id)
+        if drama_info is not None:
+            return drama_info
+        
+        if self.cache is not None:
+            cached = self.cache.get(f"drama:{drama_id}")
+            if cached is not None:
+                self._drama_memo.set(drama_id, cached)
+                self._index_drama_info(drama_id, cached)
+                return cached
+        return None
+
+    def store_drama_info(self, drama_id: int, drama_info: Dict):
+        """缓存从上游获取的广播剧信息"""
+        self._drama_memo.set(drama_id, drama_info)
+        self._index_drama_info(drama_id, drama_info)
+        if self.cache is not None:
+            self.cache.set(f"drama:{drama_id}", drama_info, ttl=DRAMA_CACHE_TTL)
+
+    def _index_drama_info(self, drama_id: int, drama_info: Dict):
+        """把 getdrama 返回的广播剧名称、作者和封面记入本地索引"""
+        drama = drama_info.get("drama")
+        if isinstance(drama, dict):
+            self.drama_index.add(drama_id, drama.get("name"), drama.get("author"), drama.get("cover"))
+
+    def get_drama_sounds(self, drama_id: int) -> List[Dict]:
+        """获取广播剧的所有分集信息"""
+        drama_info = self.get_drama_info(drama_id)
+        if not drama_info:
+            return []
+        return self.paid_episodes(drama_info)
+
+    @staticmethod
+    def paid_episodes(drama_info: Dict) -> List[Dict]:
+        """从广播剧信息中取出付费的分集"""
+        episodes = drama_info.get("episodes", [])
+        
+        # 如果episodes是列表，直接使用
+        if isinstance(episodes, list):
+            episodes_list = episodes
+        # 如果episodes是字典，提取所有值
+        elif isinstance(episodes, dict):
+            episodes_list = []
+            for ep_id, ep_data in episodes.items():
+                if isinstance(ep_data, list) and len(ep_data) > 0:
+                    episodes_list.extend(ep_data)
+                elif isinstance(ep_data, dict):
+                    episodes_list.append(ep_data)
+        else:
             return []
+        
+        # 只获取付费的分集（包括小剧场）
+        paid_episodes = [ep for ep in episodes_list 
+                      if isinstance(ep, dict) 
+                      and ep.get("need_pay") == 1]
+        return paid_episodes
 
     def get_danmaku_count(self, sound_id: int) -> Optional[int]:
         """获取指定声音的弹幕数量"""
         url = f"{self.api_url}/getdm?soundid={sound_id}"
         try:
-            response = self.session.get(url)
+            response = self.get(url)
             response.raise_for_status()
             data = response.json()
             
@@ -146,10 +721,56 @@ class MissEvanCrawler:
                 print(f"响应内容: {e.response.text}")
             return None
 
+    def get_cover_thumbnail(self, drama_id: int, size: int = THUMBNAIL_SIZE) -> Optional[Tuple[bytes, str]]:
+        """获取广播剧封面的缩略图，返回 (图片数据, Content-Type)，找不到封面时返回 None
+
+        缩略图保存在磁盘缓存中，同一封面只从上游下载一次原图。
+        """
+        cached = self.cached_cover(drama_id, size)
+        if cached is not None:
+            return cached
+        return self._inflight.do(("cover", drama_id, size), self._load_cover_thumbnail, drama_id, size)
+
+    def _load_cover_thumbnail(self, drama_id: int, size: int) -> Optional[Tuple[bytes, str]]:
+        cover_url = (self.drama_index.get(drama_id) or {}).get("cover")
+        if not cover_url:
+            cover_url = self.drama_cover_url(self.get_drama_info(drama_id))
+        if not cover_url:
+            return None
+        
+        try:
+            response = self.get(cover_url, rate_limiter=self.cover_rate_limiter)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"获取广播剧 {drama_id} 的封面失败: {e}")
+            return None
+        if not response.content:
+            return None
+        
+        thumbnail, content_type = make_thumbnail(response.content, size)
+        self.store_cover(drama_id, size, thumbnail)
+        return thumbnail, content_type
+
+    def cached_cover(self, drama_id: int, size: int) -> Optional[Tuple[bytes, str]]:
+        """从磁盘缓存读取封面缩略图，返回 (图片数据, Content-Type)"""
+        cached = self.cache.get(f"cover:{drama_id}:{size}") if self.cache is not None else None
+        return (cached, image_content_type(cached)) if cached is not None else None
+
+    def store_cover(self, drama_id: int, size: int, thumbnail: bytes):
+        """把封面缩略图写入磁盘缓存"""
+        if self.cache is not None:
+            self.cache.set(f"cover:{drama_id}:{size}", thumbnail, ttl=COVER_CACHE_TTL)
+
+    @staticmethod
+    def drama_cover_url(drama_info: Optional[Dict]) -> Optional[str]:
+        """从广播剧信息中取出封面地址"""
+        drama = drama_info.get("drama") if drama_info else None
+        return drama.get("cover") if isinstance(drama, dict) else None
+
     def get_cover_image_base64(self, image_url):
         """获取封面图片的base64编码"""
         try:
-            response = self.session.get(image_url, headers=self.headers)
+            response = self.get(image_url, rate_limiter=self.cover_rate_limiter)
             if response.status_code == 200:
                 import base64
                 return f"data:image/jpeg;base64,{base64.b64encode(response.content).decode('utf-8')}"
@@ -159,7 +780,57 @@ class MissEvanCrawler:
             return None
 
     def search_drama(self, keyword):
-        """搜索广播剧"""
+        """搜索广播剧
+
+        结果按规范化后的关键词缓存（没有结果时缓存较短时间）；如果较短的前缀关键词
+        已有完整结果，直接在其中筛选，不再请求上游。
+        """
+        key = normalize_keyword(keyword)
+        cached = self.cached_search(key)
+        if cached is not None:
+            return cached
+        
+        searched = self._search_drama_upstream(keyword)
+        if searched is None:
+            return []
+        
+        formatted_results, complete = searched
+        self.store_search(key, formatted_results, complete)
+        return list(formatted_results)
+
+    def cached_search(self, key: str) -> Optional[List[Dict]]:
+        """从搜索缓存（或已缓存的前缀关键词）中取得结果"""
+        cached = self.search_cache.get(key)
+        if cached is None:
+            cached = self._search_from_prefix(key)
+        return list(cached["results"]) if cached is not None else None
+
+    def store_search(self, key: str, results: List[Dict], complete: bool):
+        """缓存上游搜索结果，并把结果记入广播剧索引"""
+        ttl = SEARCH_CACHE_TTL if results else SEARCH_NEGATIVE_CACHE_TTL
+        self.search_cache.set(key, {"results": results, "complete": complete}, ttl=ttl)
+        for drama in results:
+            self.drama_index.add(drama['drama_id'], drama['name'], drama['author'], drama['cover'])
+
+    def _search_from_prefix(self, key: str) -> Optional[Dict]:
+        """用已缓存的前缀关键词的完整结果回答更长的关键词"""
+        for end in range(len(key) - 1, 0, -1):
+            prefix_entry = self.search_cache.get(key[:end])
+            if prefix_entry is None or not prefix_entry["complete"]:
+                continue
+            results = [drama for drama in prefix_entry["results"]
+                       if key in normalize_keyword(drama.get('name') or '')
+                       or key in normalize_keyword(drama.get('author') or '')]
+            if not results:
+                # 上游可能按其他字段或不同写法匹配到结果，本地筛选为空时仍请求上游，也不缓存空结果
+                return None
+            entry = {"results": results, "complete": True}
+            self.search_cache.set(key, entry, ttl=SEARCH_CACHE_TTL)
+            return entry
+        return None
+
+    def _search_drama_upstream(self, keyword) -> Optional[Tuple[List[Dict], bool]]:
+        """请求上游搜索接口，返回 (有付费分集的结果, 是否只有一页结果)，失败时返回 None"""
         try:
             # 使用猫耳 FM 的搜索 API
             url = f"{self.search_api_url}"
@@ -172,54 +843,70 @@ class MissEvanCrawler:
             
             print(f"Searching with URL: {url} and params: {params}")  # 调试日志
             
-            response = self.session.get(url, params=params)
+            response = self.get(url, params=params)
             response.raise_for_status()
             
             print(f"Response status: {response.status_code}")  # 调试日志
             
-            data = response.json()
-            if not data.get("success"):
-                print(f"搜索失败: {data.get('info', '未知错误')}")
-                return []
-            
-            results = data.get("info", {}).get("Datas", [])
-            print(f"Found {len(results)} drama items")  # 调试日志
+            parsed = self.parse_search_response(response.json())
+            if parsed is None:
+                return None
+            items, complete = parsed
             
-            # 格式化结果并过滤掉完全免费的广播剧
-            formatted_results = []
-            for item in results:
-                try:
-                    drama_id = item.get('id')
-                    if not drama_id:
-                        continue
-                        
-                    # 获取广播剧的分集信息
-                    episodes = self.get_drama_sounds(drama_id)
-                    if not episodes:  # 如果没有付费集，跳过这个广播剧
-                        continue
-                        
-                    formatted_results.append({
-                        'drama_id': drama_id,
-                        'name': item.get('name'),
-                        'author': item.get('author', '未知'),
-                        'cover': item.get('cover')  # 直接使用原始图片URL
-                    })
-                except Exception as e:
-                    print(f"解析广播剧项时出错: {str(e)}")
-                    continue
+            # 并发获取各结果的分集信息（结果会被缓存，之后开始统计时直接复用）
+            with ThreadPoolExecutor(max_workers=max(1, min(SEARCH_MAX_WORKERS, len(items)))) as executor:
+                futures = [metrics.submit(executor, self.get_drama_sounds, item['id']) for item in items]
+                episode_lists = [future.result() for future in futures]
             
-            print(f"Found {len(formatted_results)} dramas with paid episodes")  # 调试日志
-            return formatted_results
+            return self.format_search_results(items, episode_lists), complete
             
         except requests.exceptions.RequestException as e:
             print(f"搜索请求失败: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"响应状态码: {e.response.status_code}")
                 print(f"响应内容: {e.response.text}")
-            return []
+            return None
         except Exception as e:
             print(f"搜索广播剧时出错: {str(e)}")
-            return []
+            return None
+
+    @staticmethod
+    def parse_search_response(data: Dict) -> Optional[Tuple[List[Dict], bool]]:
+        """解析搜索接口的响应，返回 (有ID的结果项, 是否只有一页结果)，搜索失败时返回 None"""
+        if not data.get("success"):
+            print(f"搜索失败: {data.get('info', '未知错误')}")
+            return None
+        
+        info = data.get("info", {})
+        results = info.get("Datas", [])
+        # 只有一页结果时才认为结果完整，可用于回答更长的关键词
+        pagination = info.get("pagination") or {}
+        complete = "maxpage" in pagination and pagination["maxpage"] <= 1
+        print(f"Found {len(results)} drama items")  # 调试日志
+        return [item for item in results if isinstance(item, dict) and item.get('id')], complete
+
+    @staticmethod
+    def format_search_results(items: List[Dict], episode_lists: List[List[Dict]]) -> List[Dict]:
+        """格式化搜索结果并过滤掉完全免费的广播剧"""
+        formatted_results = []
+        for item, episodes in zip(items, episode_lists):
+            try:
+                drama_id = item.get('id')
+                if not episodes:  # 如果没有付费集，跳过这个广播剧
+                    continue
+                    
+                formatted_results.append({
+                    'drama_id': drama_id,
+                    'name': item.get('name'),
+                    'author': item.get('author', '未知'),
+                    'cover': item.get('cover')  # 直接使用原始图片URL
+                })
+            except Exception as e:
+                print(f"解析广播剧项时出错: {str(e)}")
+                continue
+        
+        print(f"Found {len(formatted_results)} dramas with paid episodes")  # 调试日志
+        return formatted_results
 
     def get_drama_by_name(self, name: str) -> Optional[Dict]:
         """通过名称获取广播剧信息"""
@@ -241,7 +928,7 @@ class MissEvanCrawler:
             return None
 
 def main():
-    crawler = MissEvanCrawler()
+    crawler = MissEvanCrawler(cache=DiskCache())
     
     print("=== 猫耳FM弹幕爬虫 ===")
     print("提示：您可以从猫耳FM网站上找到广播剧ID，例如：")
@@ -263,24 +950,14 @@ def main():
                 
             print(f"\n找到 {len(episodes)} 个付费分集")
             
-            # 统计所有分集的弹幕用户
-            total_danmaku_users = set()
-            for idx, episode in enumerate(episodes, 1):
-                sound_id = episode.get("sound_id")
+            # 统计所有分集的弹幕用户（并发抓取，由共享限流器控制请求节奏）
+            total_danmaku_users = UserIdSet()
+            for done, (idx, episode, danmaku_ids, _) in enumerate(crawler.iter_episode_danmaku(episodes), 1):
                 title = episode.get("name", "未知标题")
-                
-                if sound_id:
-                    print(f"\n处理分集 {idx}/{len(episodes)}: {title}")
-                    danmaku_ids = crawler.get_danmaku_ids(sound_id)
-                    total_danmaku_users.update(danmaku_ids)
-                    print(f"分集弹幕用户数: {len(danmaku_ids)}")
-                    print(f"当前累计不重复用户数: {len(total_danmaku_users)}")
-                    
-                    # 每5个请求增加一次延时
-                    if idx < len(episodes) and idx % 5 == 0:
-                        time.sleep(1.0)
-                    else:
-                        time.sleep(0.5)
+                total_danmaku_users.update(danmaku_ids)
+                print(f"\n完成分集 {done}/{len(episodes)}（第{idx}集）: {title}")
+                print(f"分集弹幕用户数: {len(danmaku_ids)}")
+                print(f"当前累计不重复用户数: {len(total_danmaku_users)}")
                         
             print(f"\n统计完成！总计不重复弹幕用户数: {len(total_danmaku_users)}")
             print()
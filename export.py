@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import struct
+import sys
+import time
+import zipfile
+from array import array
+from typing import Dict, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖，缺失时只能导出 .npy
+    pa = pq = None
+
+# 导出文件的默认目录，可通过环境变量覆盖
+DEFAULT_EXPORT_DIR = os.environ.get('MISSEVAN_EXPORT_DIR', 'exports')
+EXPORT_FORMATS = ('npy', 'parquet')
+PARQUET_AVAILABLE = pq is not None
+
+# 各列的名称、array 类型码和对应的 .npy 数据类型（小端）
+COLUMNS = (
+    ('sound_id', 'q', '<i8'),
+    ('stime', 'f', '<f4'),      # 弹幕出现在视频中的秒数
+    ('send_time', 'q', '<i8'),  # 发送时间（Unix 时间戳）
+    ('user_id', 'q', '<i8'),
+    ('danmaku_id', 'q', '<i8'),
+)
+# .npy 文件头的固定长度，写完数据后原地改写行数
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(descr: str, rows: int) -> bytes:
+    """生成 .npy 1.0 格式的文件头，补齐到固定长度"""
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': (rows,)}).encode('latin1')
+    prefix_size = 10  # 魔数 6 字节、版本 2 字节、头长度 2 字节
+    header += b' ' * (_NPY_HEADER_SIZE - prefix_size - len(header) - 1) + b'\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header
+
+
+class NpyColumnWriter:
+    """逐批追加写入一维 .npy 文件，不需要 numpy，也不需要预先知道总行数
+
+    生成的文件可以用 numpy.load(path, mmap_mode='r') 直接内存映射。
+    """
+
+    def __init__(self, path: str, typecode: str, descr: str):
+        self.path = path
+        self.typecode = typecode
+        self.descr = descr
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(_npy_header(descr, 0))
+
+    def write(self, values: array):
+        if values.typecode != self.typecode:
+            values = array(self.typecode, values)
+        if values.itemsize > 1 and sys.byteorder == 'big':
+            values.byteswap()  # .npy 按小端保存
+        values.tofile(self._file)
+        self.rows += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.descr, self.rows))
+        self._file.close()
+
+
+class DanmakuExportWriter:
+    """把解析后的弹幕按列写入导出文件
+
+    npy 格式在目标目录中为每列写一个 .npy 文件，弹幕文本（可选）保存为
+    UTF-8 字节数组 text_data.npy 和长度为行数+1 的偏移量 text_offsets.npy，
+    另有 meta.json 记录列、行数和分集；parquet 格式（需要 pyarrow）写入单个文件，
+    每个分集一个 row group。
+    """
+
+    def __init__(self, path: str, fmt: str = 'npy', with_text: bool = False):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        if fmt == 'parquet' and not PARQUET_AVAILABLE:
+            raise ValueError("导出 Parquet 需要安装 pyarrow")
+        self.path = path
+        self.fmt = fmt
+        self.with_text = with_text
+        self.rows = 0
+        self.sound_ids: List[int] = []
+        if fmt == 'npy':
+            os.makedirs(path, exist_ok=True)
+            self._columns = {name: NpyColumnWriter(os.path.join(path, f"{name}.npy"), typecode, descr)
+                             for name, typecode, descr in COLUMNS}
+            if with_text:
+                self._text_data = NpyColumnWriter(os.path.join(path, "text_data.npy"), 'B', '|u1')
+                self._text_offsets = NpyColumnWriter(os.path.join(path, "text_offsets.npy"), 'q', '<i8')
+                self._text_offsets.write(array('q', [0]))
+                self._text_size = 0
+        else:
+            parent = os.path.dirname(path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            fields = [pa.field('sound_id', pa.int64()), pa.field('stime', pa.float32()),
+                      pa.field('send_time', pa.int64()), pa.field('user_id', pa.int64()),
+                      pa.field('danmaku_id', pa.int64())]
+            if with_text:
+                fields.append(pa.field('text', pa.string()))
+            self._schema = pa.schema(fields)
+            self._parquet = pq.ParquetWriter(path, self._schema, compression='zstd')
+
+    @staticmethod
+    def new_columns(with_text: bool = False) -> Dict:
+        """返回一个分集的空列缓冲区，可以在抓取线程中填充后交给 write"""
+        columns = {name: array(typecode) for name, typecode, _ in COLUMNS}
+        if with_text:
+            columns['text'] = []
+        return columns
+
+    def write(self, sound_id: int, columns: Dict):
+        """写入一个分集的所有弹幕"""
+        rows = len(columns['user_id'])
+        self.sound_ids.append(sound_id)
+        self.rows += rows
+        if self.fmt == 'parquet':
+            data = [pa.array(columns[name], type=field.type)
+                    for (name, _, _), field in zip(COLUMNS, self._schema)]
+            if self.with_text:
+                data.append(pa.array(columns['text'], type=pa.string()))
+            self._parquet.write_table(pa.Table.from_arrays(data, schema=self._schema))
+            return
+        for name, _, _ in COLUMNS:
+            self._columns[name].write(columns[name])
+        if self.with_text:
+            blob = bytearray()
+            offsets = array('q')
+            for text in columns['text']:
+                blob += text.encode('utf-8')
+                offsets.append(self._text_size + len(blob))
+            self._text_size += len(blob)
+            self._text_data.write(array('B', blob))
+            self._text_offsets.write(offsets)
+
+    def close(self) -> Dict:
+        """结束写入，返回导出信息"""
+        meta = {
+            'format': self.fmt,
+            'rows': self.rows,
+            'columns': [name for name, _, _ in COLUMNS] + (['text'] if self.with_text else []),
+            'sound_ids': self.sound_ids,
+            'created_at': time.time()
+        }
+        if self.fmt == 'parquet':
+            self._parquet.close()
+            return meta
+        writers = list(self._columns.values())
+        if self.with_text:
+            writers += [self._text_data, self._text_offsets]
+        for writer in writers:
+            writer.close()
+        meta['dtypes'] = {name: descr for name, _, descr in COLUMNS}
+        with open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return meta
+
+
+def package_export(path: str) -> str:
+    """把 npy 导出目录打包为不压缩的 zip（解压后即可内存映射），返回 zip 路径并删除目录"""
+    zip_path = f"{path}.zip"
+    tmp_path = f"{zip_path}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in sorted(os.listdir(path)):
+            archive.write(os.path.join(path, name), name)
+    os.replace(tmp_path, zip_path)
+    shutil.rmtree(path)
+    return zip_path
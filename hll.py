@@ -0,0 +1,94 @@
+import math
+from typing import Iterable, Union
+
+# 精度 p 的取值范围，寄存器数量为 2^p，相对误差约为 1.04 / sqrt(2^p)
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+DEFAULT_PRECISION = 14
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value: int) -> int:
+    """splitmix64 整数哈希，把用户ID均匀打散到 64 位"""
+    x = (value + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class HyperLogLog:
+    """HyperLogLog 去重计数估计器
+
+    内存固定为 2^precision 字节，与用户数无关；同精度的估计器可以合并，
+    因此按分集保存后可以跨分集、跨广播剧汇总而无需重新抓取。
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precision 必须在 {MIN_PRECISION} 到 {MAX_PRECISION} 之间")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @property
+    def error_bound(self) -> float:
+        """估计值的标准相对误差"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value: int):
+        """加入一个用户ID"""
+        p = self.precision
+        h = hash64(value)
+        index = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Union["HyperLogLog", Iterable[int]]):
+        """批量加入用户ID，或合并另一个同精度的估计器"""
+        if isinstance(values, HyperLogLog):
+            if values.precision != self.precision:
+                raise ValueError("只能合并相同精度的 HyperLogLog")
+            self.registers = bytearray(map(max, self.registers, values.registers))
+            return
+        p = self.precision
+        shift = 64 - p
+        rest_mask = (1 << shift) - 1
+        registers = self.registers
+        for value in values:
+            h = hash64(value)
+            index = h >> shift
+            rank = shift - (h & rest_mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self) -> float:
+        """估计不重复用户数"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时使用线性计数修正
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def to_bytes(self) -> bytes:
+        """序列化为字节，用于缓存"""
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """从 to_bytes 的结果还原"""
+        sketch = cls(data[0])
+        if len(data) - 1 != len(sketch.registers):
+            raise ValueError("HyperLogLog 数据长度不正确")
+        sketch.registers = bytearray(data[1:])
+        return sketch
+
+    def __len__(self) -> int:
+        return int(round(self.count()))
+
+    def __repr__(self) -> str:
+        return f"HyperLogLog(precision={self.precision}, estimate={len(self)})"
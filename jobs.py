@@ -0,0 +1,602 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextvars import copy_context
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# 每个任务最多保留的进度消息条数，更早的消息会被丢弃
+DEFAULT_BUFFER_SIZE = 1000
+# 共享存储中未结束的任务超过该时间（秒）没有心跳，视为所在进程已退出
+STALE_AFTER = 120
+HEARTBEAT_INTERVAL = 30
+STALE_ERROR = '任务所在进程已退出'
+# 共享存储等待新消息时的轮询间隔（秒）
+POLL_INTERVAL = 0.25
+
+
+class JobQueueFull(Exception):
+    """等待队列已满，调用方应稍后重试（对应 HTTP 429）"""
+
+
+class JobCancelled(Exception):
+    """任务已被取消，任务函数可以抛出此异常提前结束"""
+
+
+class MemoryJobStore:
+    """保存在进程内存中的任务状态和进度消息，只适用于单进程部署"""
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._jobs: Dict[str, Dict] = {}
+        self._keys: Dict[Hashable, str] = {}
+        self._groups: Dict[Hashable, str] = {}  # 每组最近新建的任务
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+    def create(self, key: Optional[Hashable], group: Optional[Hashable] = None) -> Tuple[str, bool]:
+        """新建任务，返回 (任务ID, 是否新建)；相同 key 的任务未结束时返回已有任务"""
+        with self._lock:
+            if key is not None and key in self._keys:
+                existing = self._jobs[self._keys[key]]
+                if existing['status'] not in FINISHED_STATES:
+                    return existing['id'], False
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id, 'key': key, 'group': group, 'status': PENDING, 'result': None, 'error': None,
+                'created_at': time.time(), 'finished_at': None, 'cancel_requested': False,
+                'messages': deque(maxlen=self.buffer_size), 'first_id': 0
+            }
+            if key is not None:
+                self._keys[key] = job_id
+            if group is not None:
+                self._groups[group] = job_id
+            return job_id, True
+
+    def delete(self, job_id: str):
+        with self._lock:
+            record = self._jobs.pop(job_id, None)
+            if record and record['key'] is not None and self._keys.get(record['key']) == job_id:
+                del self._keys[record['key']]
+            if record and record['group'] is not None and self._groups.get(record['group']) == job_id:
+                del self._groups[record['group']]
+
+    def find(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            return self._keys.get(key)
+
+    def find_group(self, group: Hashable) -> Optional[str]:
+        with self._lock:
+            return self._groups.get(group)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return None
+            return {field: value for field, value in record.items() if field not in ('messages', 'first_id')}
+
+    def update(self, job_id: str, **fields):
+        with self._changed:
+            record = self._jobs.get(job_id)
+            if record is not None:
+                record.update(fields)
+                self._changed.notify_all()
+
+    def start(self, job_id: str) -> bool:
+        """把等待中且未被取消的任务标记为运行中，返回是否成功"""
+        with self._changed:
+            record = self._jobs.get(job_id)
+            if record is None or record['status'] != PENDING or record['cancel_requested']:
+                return False
+            record['status'] = RUNNING
+            self._changed.notify_all()
+            return True
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消未结束的任务，等待中的任务直接标记为已取消"""
+        with self._changed:
+            record = self._jobs.get(job_id)
+            if record is None or record['status'] in FINISHED_STATES:
+                return False
+            record['cancel_requested'] = True
+            if record['status'] == PENDING:
+                record['status'] = CANCELLED
+                record['finished_at'] = time.time()
+            self._changed.notify_all()
+            return True
+
+    def touch(self, job_ids: List[str]):
+        """进程内存储不需要心跳"""
+
+    def fail_stale(self):
+        """进程内存储的任务随进程一起退出，不会失去心跳"""
+
+    def append(self, job_id: str, message: Dict):
+        with self._changed:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return
+            if len(record['messages']) == record['messages'].maxlen:
+                record['first_id'] += 1
+            record['messages'].append(message)
+            self._changed.notify_all()
+
+    def read(self, job_id: str, cursor: int) -> Tuple[List[Dict], int]:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return [], cursor
+            first_id = record['first_id']
+            start = max(cursor, first_id) - first_id
+            return list(islice(record['messages'], start, None)), first_id + len(record['messages'])
+
+    def wait(self, job_id: str, cursor: int, timeout: Optional[float]) -> Tuple[List[Dict], int]:
+        def ready():
+            record = self._jobs.get(job_id)
+            return (record is None or record['status'] in FINISHED_STATES
+                    or record['first_id'] + len(record['messages']) > cursor)
+        with self._changed:
+            self._changed.wait_for(ready, timeout)
+            return self.read(job_id, cursor)
+
+    def cleanup(self, finished_ttl: float):
+        """删除结束时间超过 finished_ttl 秒的任务"""
+        deadline = time.time() - finished_ttl
+        with self._lock:
+            expired = [job_id for job_id, record in self._jobs.items()
+                       if record['finished_at'] is not None and record['finished_at'] < deadline]
+            for job_id in expired:
+                self.delete(job_id)
+
+
+class SQLiteJobStore:
+    """保存在 SQLite（WAL 模式）文件中的任务状态和进度消息
+
+    同一台机器上的多个 gunicorn worker 进程共用一个文件，任何进程都能查询进度、
+    加入进行中的任务或请求取消；等待新消息时按固定间隔轮询。
+    未结束的任务由执行它的进程定期刷新心跳，超过 STALE_AFTER 秒没有心跳视为失败：
+    查询时立即按失败返回，各进程的心跳线程也会定期把它们标记为失败。
+    """
+
+    def __init__(self, path: str, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " key TEXT,"
+            " status TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " updated_at REAL NOT NULL,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " next_seq INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs(key)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'job_group' not in columns:  # 旧版本创建的文件没有 job_group 列
+            try:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN job_group TEXT")
+            except sqlite3.OperationalError:
+                pass  # 其他进程已经添加
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_group ON jobs(job_group)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_messages ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " body TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+
+    @staticmethod
+    def _encode_key(key: Optional[Hashable]) -> Optional[str]:
+        return json.dumps(key, ensure_ascii=False) if key is not None else None
+
+    def _transaction(self, fn: Callable[[], Any]) -> Any:
+        """在 BEGIN IMMEDIATE 事务中执行 fn，保证多个进程间的读改写是原子的"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def create(self, key: Optional[Hashable], group: Optional[Hashable] = None) -> Tuple[str, bool]:
+        """新建任务，返回 (任务ID, 是否新建)；相同 key 的任务未结束时返回已有任务"""
+        encoded_key = self._encode_key(key)
+        encoded_group = self._encode_key(group)
+
+        def create():
+            now = time.time()
+            # 心跳超时的任务所在进程已退出，标记为失败，以免永远占着 key
+            self._fail_stale(now)
+            if encoded_key is not None:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                    (encoded_key, PENDING, RUNNING)
+                ).fetchone()
+                if row:
+                    return row[0], False
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, key, job_group, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, encoded_key, encoded_group, PENDING, now, now)
+            )
+            return job_id, True
+        return self._transaction(create)
+
+    def _fail_stale(self, now: float):
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE status IN (?, ?) AND updated_at < ?",
+            (FAILED, STALE_ERROR, now, PENDING, RUNNING, now - STALE_AFTER)
+        )
+
+    def fail_stale(self):
+        """把心跳超时的未结束任务标记为失败"""
+        with self._lock:
+            self._fail_stale(time.time())
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM job_messages WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def find(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE key = ? ORDER BY created_at DESC LIMIT 1",
+                (self._encode_key(key),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_group(self, group: Hashable) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE job_group = ? ORDER BY created_at DESC LIMIT 1",
+                (self._encode_key(group),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, key, status, result, error, created_at, finished_at, cancel_requested, updated_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        record = {
+            'id': row[0],
+            'key': json.loads(row[1]) if row[1] is not None else None,
+            'status': row[2],
+            'result': json.loads(row[3]) if row[3] is not None else None,
+            'error': row[4],
+            'created_at': row[5],
+            'finished_at': row[6],
+            'cancel_requested': bool(row[7])
+        }
+        if record['status'] in (PENDING, RUNNING) and row[8] < time.time() - STALE_AFTER:
+            # 心跳超时但还没有被标记为失败的任务按失败返回，等待它的客户端不会一直等下去
+            record.update(status=FAILED, error=STALE_ERROR, finished_at=row[8] + STALE_AFTER)
+        return record
+
+    def update(self, job_id: str, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], ensure_ascii=False)
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{field} = ?" for field in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def start(self, job_id: str) -> bool:
+        """把等待中且未被取消的任务标记为运行中，返回是否成功"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ? AND cancel_requested = 0",
+                (RUNNING, time.time(), job_id, PENDING)
+            )
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消未结束的任务，等待中的任务直接标记为已取消"""
+        def cancel():
+            now = time.time()
+            cursor = self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (now, job_id, PENDING, RUNNING)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, now, job_id, PENDING)
+            )
+            return cursor.rowcount > 0
+        return self._transaction(cancel)
+
+    def touch(self, job_ids: List[str]):
+        """刷新本进程负责的任务的心跳时间"""
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("UPDATE jobs SET updated_at = ? WHERE id = ?",
+                                   [(now, job_id) for job_id in job_ids])
+
+    def append(self, job_id: str, message: Dict):
+        body = json.dumps(message, ensure_ascii=False)
+
+        def append():
+            row = self._conn.execute("SELECT next_seq FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            seq = row[0]
+            self._conn.execute("INSERT INTO job_messages (job_id, seq, body) VALUES (?, ?, ?)",
+                               (job_id, seq, body))
+            self._conn.execute("UPDATE jobs SET next_seq = ?, updated_at = ? WHERE id = ?",
+                               (seq + 1, time.time(), job_id))
+            # 只保留最近 buffer_size 条消息
+            self._conn.execute("DELETE FROM job_messages WHERE job_id = ? AND seq <= ?",
+                               (job_id, seq - self.buffer_size))
+        self._transaction(append)
+
+    def read(self, job_id: str, cursor: int) -> Tuple[List[Dict], int]:
+        with self._lock:
+            row = self._conn.execute("SELECT next_seq FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return [], cursor
+            rows = self._conn.execute(
+                "SELECT body FROM job_messages WHERE job_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (job_id, cursor, row[0])
+            ).fetchall()
+        return [json.loads(body) for body, in rows], row[0]
+
+    def wait(self, job_id: str, cursor: int, timeout: Optional[float]) -> Tuple[List[Dict], int]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            messages, next_cursor = self.read(job_id, cursor)
+            if messages or next_cursor > cursor:
+                return messages, next_cursor
+            record = self.get(job_id)
+            if record is None or record['status'] in FINISHED_STATES:
+                return messages, next_cursor
+            if deadline is not None and time.monotonic() >= deadline:
+                return messages, next_cursor
+            time.sleep(POLL_INTERVAL)
+
+    def cleanup(self, finished_ttl: float):
+        """删除结束时间超过 finished_ttl 秒的任务及其进度消息"""
+        deadline = time.time() - finished_ttl
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM job_messages WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)", (deadline,)
+            )
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (deadline,))
+
+
+def create_job_store(backend: str = 'memory', path: Optional[str] = None,
+                     buffer_size: int = DEFAULT_BUFFER_SIZE):
+    """按名称创建任务存储：memory（单进程）或 sqlite（同一台机器上的多进程共享）"""
+    if backend == 'memory':
+        return MemoryJobStore(buffer_size)
+    if backend == 'sqlite':
+        return SQLiteJobStore(path or 'missevan_jobs.sqlite3', buffer_size)
+    raise ValueError(f"未知的任务存储类型: {backend}")
+
+
+class Job:
+    """一个后台任务的句柄，状态和进度消息都保存在任务存储中
+
+    进度消息保存在固定长度的环形缓冲区中，每条消息有递增的序号，
+    多个客户端可以各自按游标读取（或等待新消息），互不影响。
+    """
+
+    def __init__(self, store, job_id: str):
+        self.store = store
+        self.id = job_id
+
+    def _record(self) -> Dict:
+        return self.store.get(self.id) or {}
+
+    @property
+    def status(self) -> Optional[str]:
+        return self._record().get('status')
+
+    @property
+    def result(self) -> Any:
+        return self._record().get('result')
+
+    @property
+    def error(self) -> Optional[str]:
+        return self._record().get('error')
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancelled(self) -> bool:
+        return bool(self._record().get('cancel_requested'))
+
+    def check_cancelled(self):
+        """任务已被取消时抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def put(self, message: Dict):
+        """追加一条进度消息"""
+        self.store.append(self.id, message)
+
+    def read(self, cursor: int = 0) -> Tuple[List[Dict], int]:
+        """返回序号不小于 cursor 的消息和新的游标（下一条消息的序号）
+
+        返回的第 i 条消息序号为 新游标 - len(消息) + i；已被丢弃的消息不会返回。
+        """
+        return self.store.read(self.id, cursor)
+
+    def wait(self, cursor: int, timeout: Optional[float] = None) -> Tuple[List[Dict], int]:
+        """等待直到有序号不小于 cursor 的新消息、任务结束或超时，然后同 read"""
+        return self.store.wait(self.id, cursor, timeout)
+
+    def set_status(self, status: str, **fields):
+        """更新任务状态（以及 result、error 字段），并唤醒等待新消息的客户端"""
+        if status in FINISHED_STATES:
+            fields['finished_at'] = time.time()
+        self.store.update(self.id, status=status, **fields)
+
+    def to_dict(self) -> Dict:
+        record = self._record()
+        return {
+            'job_id': self.id,
+            'status': record.get('status'),
+            'created_at': record.get('created_at'),
+            'finished_at': record.get('finished_at'),
+            'result': record.get('result'),
+            'error': record.get('error')
+        }
+
+
+class JobScheduler:
+    """固定大小线程池的后台任务调度器
+
+    等待中的任务数有上限（已取消的不计入），满了以后 submit 抛出 JobQueueFull；相同 key 的任务未结束时
+    直接返回已有任务；结束超过 finished_ttl 秒的任务及其进度消息会被清理。
+    任务状态保存在 store 中（默认保存在进程内存中），使用 SQLiteJobStore 时
+    多个进程可以共享任务：任务在提交它的进程中执行，任何进程都能查询、加入或取消。
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, finished_ttl: float = 600,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, store=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.finished_ttl = finished_ttl
+        self.store = store if store is not None else MemoryJobStore(buffer_size)
+        # 队列本身不限长度，已取消的任务留在队列中由 worker 跳过；上限按 _pending 计算
+        self._queue: "queue.Queue[Tuple[Job, Callable[[Job], Any]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._local_jobs: Dict[str, Job] = {}  # 本进程负责执行的（等待中或运行中的）任务
+        self._pending: Set[str] = set()  # 本进程等待执行且未被取消的任务
+        self._active = 0
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, fn: Callable[[Job], Any], key: Optional[Hashable] = None,
+               group: Optional[Hashable] = None) -> Tuple[Job, bool]:
+        """提交任务，返回 (任务, 是否新建)；fn 接收 Job 参数，返回值保存为任务结果
+
+        group 用于把 key 不同的相关任务（如同一广播剧不同选项的统计）归为一组，
+        可通过 get_latest 查找组内最近新建的任务。
+        """
+        self.store.cleanup(self.finished_ttl)
+        with self._lock:
+            job_id, created = self.store.create(key, group)
+            job = Job(self.store, job_id)
+            if not created:
+                return job, False
+            if len(self._pending) >= self.max_pending:
+                # 其他进程取消的（或被判定为失败的）任务不再占用名额
+                self._pending = {pending_id for pending_id in self._pending
+                                 if (self.store.get(pending_id) or {}).get('status') == PENDING}
+            if len(self._pending) >= self.max_pending:
+                self.store.delete(job_id)
+                raise JobQueueFull()
+            self._pending.add(job_id)
+            self._local_jobs[job_id] = job
+            self._queue.put_nowait((job, fn))
+            return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """按任务ID查找任务"""
+        if self.store.get(job_id) is None:
+            return None
+        return Job(self.store, job_id)
+
+    def get_by_key(self, key: Hashable) -> Optional[Job]:
+        """查找某个 key 最近一次提交的任务"""
+        job_id = self.store.find(key)
+        return Job(self.store, job_id) if job_id else None
+
+    def get_latest(self, group: Hashable) -> Optional[Job]:
+        """查找某组最近新建的任务"""
+        job_id = self.store.find_group(group)
+        return Job(self.store, job_id) if job_id else None
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消任务；等待中的任务不会再执行，运行中的任务需自行检查 cancelled"""
+        cancelled = self.store.cancel(job_id)
+        if cancelled:
+            with self._lock:
+                self._pending.discard(job_id)
+        return cancelled
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def active_count(self) -> int:
+        return self._active
+
+    def _worker(self):
+        while True:
+            job, fn = self._queue.get()
+            with self._lock:
+                self._pending.discard(job.id)
+            if not self.store.start(job.id):
+                # 等待期间已被取消（或被其他进程判定为失败）
+                self._release(job)
+                continue
+            with self._lock:
+                self._active += 1
+            try:
+                # 每个任务在独立的 contextvars 上下文中执行，互不影响
+                result = copy_context().run(fn, job)
+                job.set_status(CANCELLED if job.cancelled else DONE, result=result)
+            except JobCancelled:
+                job.set_status(CANCELLED)
+            except Exception as e:
+                job.set_status(FAILED, error=str(e))
+            finally:
+                with self._lock:
+                    self._active -= 1
+                self._release(job)
+
+    def _release(self, job: Job):
+        with self._lock:
+            self._local_jobs.pop(job.id, None)
+
+    def _heartbeat(self):
+        """定期刷新本进程任务的心跳，避免被其他进程判定为已退出；同时把其他进程遗留的任务标记为失败"""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                job_ids = list(self._local_jobs)
+            try:
+                self.store.touch(job_ids)
+                self.store.fail_stale()
+            except Exception as e:
+                print(f"刷新任务心跳时出错: {str(e)}")
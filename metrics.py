@@ -0,0 +1,247 @@
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 直方图默认的桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """采集时调用函数取值的瞬时值"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._function: Callable[[], float] = lambda: 0
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self._function())}"]
+
+
+class Histogram(_Metric):
+    """按固定桶统计分布的直方图，同时记录总和与次数"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List] = {}  # [各桶计数, 总和, 次数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(entry[0]), entry[1], entry[2]]) for key, entry in self._values.items())
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class JobTimings:
+    """一个任务的各阶段耗时和计数汇总（线程安全）
+
+    各阶段耗时是所有抓取线程的累计值，可能超过任务的实际用时。
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._seconds: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def summary(self) -> Dict:
+        with self._lock:
+            seconds = {stage: round(value, 3) for stage, value in self._seconds.items()}
+            counts = dict(self._counts)
+        elapsed = time.monotonic() - self.started_at
+        summary = {'elapsed': round(elapsed, 3), 'seconds': seconds, **counts}
+        if counts.get('comments') and elapsed > 0:
+            summary['comments_per_second'] = round(counts['comments'] / elapsed, 1)
+        lookups = counts.get('cache_hits', 0) + counts.get('cache_misses', 0)
+        if lookups:
+            summary['cache_hit_rate'] = round(counts.get('cache_hits', 0) / lookups, 3)
+        return summary
+
+
+# 当前任务的耗时汇总；抓取线程通过 contextvars.copy_context() 继承
+_current_timings: "ContextVar[Optional[JobTimings]]" = ContextVar('job_timings', default=None)
+
+REGISTRY: List[_Metric] = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+HTTP_REQUEST_SECONDS = _register(Histogram(
+    'missevan_http_request_seconds', '上游接口从发出请求到收到响应头的耗时', ('endpoint',)))
+HTTP_RESPONSES = _register(Counter(
+    'missevan_http_responses_total', '上游接口的响应数', ('endpoint', 'status')))
+HTTP_BYTES = _register(Counter(
+    'missevan_http_bytes_total', '从上游接口下载的字节数', ('endpoint',)))
+STAGE_SECONDS = _register(Histogram(
+    'missevan_stage_seconds', '各处理阶段的耗时（ratelimit_wait、download、parse、merge）', ('stage',)))
+DANMAKU_COMMENTS = _register(Counter(
+    'missevan_danmaku_comments_total', '解析的弹幕条数'))
+CACHE_REQUESTS = _register(Counter(
+    'missevan_cache_requests_total', '缓存查询次数', ('cache', 'result')))
+JOB_QUEUE_DEPTH = _register(Gauge(
+    'missevan_job_queue_depth', '本进程等待执行的任务数'))
+JOBS_ACTIVE = _register(Gauge(
+    'missevan_jobs_active', '本进程正在执行的任务数'))
+
+
+def begin_timings() -> JobTimings:
+    """在当前上下文中开始一个新的耗时汇总（后台任务各自在独立的上下文中执行）"""
+    timings = JobTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def observe_stage(stage: str, seconds: float):
+    """记录一个阶段的耗时"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    """记录 with 块的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_http(endpoint: str, seconds: float, status: int):
+    HTTP_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    HTTP_RESPONSES.inc(endpoint=endpoint, status=status)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add('http', seconds)
+        timings.incr('requests')
+
+
+def add_bytes(endpoint: str, size: int):
+    HTTP_BYTES.inc(size, endpoint=endpoint)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.incr('bytes', size)
+
+
+def add_comments(count: int):
+    DANMAKU_COMMENTS.inc(count)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.incr('comments', count)
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.incr('cache_hits' if hit else 'cache_misses')
+
+
+def render() -> str:
+    """以 Prometheus 文本格式输出本进程的所有指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def submit(executor: Executor, fn: Callable, *args) -> Future:
+    """向线程池提交任务，任务中记录的耗时也计入当前任务的汇总"""
+    return executor.submit(copy_context().run, fn, *args)
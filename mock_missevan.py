@@ -0,0 +1,313 @@
+"""本地模拟的猫耳FM接口，用于离线测试和基准测试
+
+提供 /dramaapi/getdrama、/dramaapi/search、/sound/getdm 三个接口和封面图片 /cover/<drama_id>.png，返回确定性的合成数据
+（同样的参数总是生成同样的广播剧、分集和弹幕），也可以从目录中回放录制的响应。
+客户端接受 gzip 时压缩响应；getdm 带 ETag，支持 If-None-Match 条件请求（返回 304）。
+
+    fixtures/getdrama/<drama_id>.json
+    fixtures/search/<关键词>.json
+    fixtures/getdm/<sound_id>.xml
+
+用法：python mock_missevan.py --port 8000 --episodes 20 --comments 5000
+然后以 MissEvanCrawler(base_url="http://127.0.0.1:8000") 或环境变量
+MISSEVAN_BASE_URL=http://127.0.0.1:8000 启动网页服务。
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+# 第一部模拟广播剧的ID，分集的 sound_id 为 drama_id * SOUND_ID_STRIDE + 分集序号
+FIRST_DRAMA_ID = 1000
+SOUND_ID_STRIDE = 1000
+# 每页搜索结果数
+SEARCH_PAGE_SIZE = 10
+# 分块发送弹幕XML时每块的字节数
+RESPONSE_CHUNK_SIZE = 64 * 1024
+# 合成封面图片的尺寸
+COVER_WIDTH = 400
+COVER_HEIGHT = 560
+
+
+class MockMissEvan:
+    """模拟猫耳FM接口的数据和 HTTP 服务
+
+    dramas 部广播剧，每部 episodes 个付费分集和 free_episodes 个免费分集，
+    每个分集 comments 条弹幕，发送者从 users 个用户中随机选取；
+    每个请求在返回前等待 latency 秒。
+    """
+
+    def __init__(self, dramas: int = 3, episodes: int = 10, comments: int = 1000, users: int = 500,
+                 latency: float = 0.0, free_episodes: int = 1, seed: int = 0,
+                 fixtures_dir: Optional[str] = None):
+        self.dramas = dramas
+        self.episodes = episodes
+        self.comments = comments
+        self.users = users
+        self.latency = latency
+        self.free_episodes = free_episodes
+        self.seed = seed
+        self.fixtures_dir = fixtures_dir
+        self.requests: Dict[str, int] = {}  # 各接口收到的请求数
+        self.not_modified = 0  # 返回 304 的条件请求数
+        self.failing_sound_ids: Set[int] = set()  # 请求这些分集的弹幕时返回 500，用于测试失败处理
+        self.unavailable = 0  # 接下来的这么多个请求返回 503，用于测试重试
+        self.dropped = 0  # 接下来的这么多个请求不响应直接断开连接，用于测试重试
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        # 生成的弹幕XML按分集缓存，重复请求时不重新生成
+        self.danmaku_xml = lru_cache(maxsize=256)(self._danmaku_xml)
+
+    # 合成数据
+
+    @property
+    def drama_ids(self) -> List[int]:
+        return list(range(FIRST_DRAMA_ID, FIRST_DRAMA_ID + self.dramas))
+
+    def drama_name(self, drama_id: int) -> str:
+        return f"模拟广播剧{drama_id}"
+
+    def paid_sound_ids(self, drama_id: int) -> List[int]:
+        return [drama_id * SOUND_ID_STRIDE + i for i in range(1, self.episodes + 1)]
+
+    def drama_info(self, drama_id: int) -> Optional[Dict]:
+        """getdrama 接口的 info 字段"""
+        if drama_id not in self.drama_ids:
+            return None
+        episodes = [{"sound_id": sound_id, "name": f"第{i}集", "need_pay": 1}
+                    for i, sound_id in enumerate(self.paid_sound_ids(drama_id), 1)]
+        extras = [{"sound_id": drama_id * SOUND_ID_STRIDE + self.episodes + i, "name": f"花絮{i}", "need_pay": 0}
+                  for i in range(1, self.free_episodes + 1)]
+        return {
+            "drama": {
+                "id": drama_id,
+                "name": self.drama_name(drama_id),
+                "author": f"作者{drama_id % 7}",
+                "cover": f"{self.base_url}/cover/{drama_id}.png" if self._server
+                         else f"https://static.missevan.com/mock/{drama_id}.jpg"
+            },
+            "episodes": {"episode": episodes, "ft": extras}
+        }
+
+    def iter_danmaku(self, sound_id: int):
+        """逐条生成一个分集的弹幕 (视频中的秒数, 发送时间, 用户ID, 弹幕ID, 文本)"""
+        rng = random.Random(self.seed * 1000003 + sound_id)
+        send_time = 1500000000 + sound_id
+        for i in range(self.comments):
+            send_time += rng.randint(1, 600)
+            yield (round(rng.uniform(0, 1800), 3), send_time, rng.randint(1, self.users),
+                   sound_id * 10 ** 7 + i + 1, f"弹幕{i}")
+
+    def danmaku_etag(self, body: bytes) -> str:
+        return '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def _danmaku_xml(self, sound_id: int) -> bytes:
+        parts = ['<?xml version="1.0" encoding="UTF-8"?><i><chatserver>chat.missevan.com</chatserver>']
+        for stime, send_time, user_id, danmaku_id, text in self.iter_danmaku(sound_id):
+            parts.append(f'<d p="{stime},1,25,16777215,{send_time},0,{user_id},{danmaku_id}">'
+                         f'{escape(text)}</d>')
+        parts.append('</i>')
+        return ''.join(parts).encode('utf-8')
+
+    def cover_png(self, drama_id: int) -> bytes:
+        """生成一张纯色的 PNG 封面（颜色由广播剧ID决定）"""
+        color = bytes(((drama_id * 37) % 256, (drama_id * 91) % 256, (drama_id * 53) % 256))
+        raw = (b'\x00' + color * COVER_WIDTH) * COVER_HEIGHT
+
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        header = struct.pack('>IIBBBBB', COVER_WIDTH, COVER_HEIGHT, 8, 2, 0, 0, 0)
+        return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw))
+                + chunk(b'IEND', b''))
+
+    def unique_users(self, sound_ids: List[int]) -> Set[int]:
+        """一组分集的不重复弹幕用户，用于核对统计结果"""
+        users = set()
+        for sound_id in sound_ids:
+            users.update(user_id for _, _, user_id, _, _ in self.iter_danmaku(sound_id))
+        return users
+
+    def search(self, keyword: str, page: int = 1) -> Dict:
+        """search 接口的 info 字段：名称或作者包含关键词的广播剧"""
+        matches = [self.drama_info(drama_id)["drama"] for drama_id in self.drama_ids]
+        matches = [drama for drama in matches if keyword in drama["name"] or keyword in drama["author"]]
+        start = (page - 1) * SEARCH_PAGE_SIZE
+        return {
+            "Datas": matches[start:start + SEARCH_PAGE_SIZE],
+            "pagination": {
+                "p": page,
+                "count": len(matches),
+                "maxpage": max(1, -(-len(matches) // SEARCH_PAGE_SIZE)),
+                "pagesize": SEARCH_PAGE_SIZE
+            }
+        }
+
+    def _fixture(self, *parts: str) -> Optional[bytes]:
+        if not self.fixtures_dir:
+            return None
+        path = os.path.join(self.fixtures_dir, *parts)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    # HTTP 服务
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """在后台线程中启动服务，port 为 0 时自动选择端口，返回服务地址"""
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-missevan", daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "MockMissEvan":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def _take(self, counter: str) -> bool:
+        """计数器 unavailable 或 dropped 大于 0 时减一并返回 True"""
+        with self._lock:
+            if getattr(self, counter) <= 0:
+                return False
+            setattr(self, counter, getattr(self, counter) - 1)
+            return True
+
+    def _count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+
+def _make_handler(mock: MockMissEvan):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass  # 不输出每个请求的日志
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            mock._count(url.path)
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock._take("dropped"):
+                self.close_connection = True
+                return
+            if mock._take("unavailable"):
+                self._send(503, "text/plain", b"service unavailable")
+                return
+            try:
+                if url.path == "/dramaapi/getdrama":
+                    drama_id = query.get("drama_id", "")
+                    body = mock._fixture("getdrama", f"{drama_id}.json")
+                    if body is None:
+                        info = mock.drama_info(int(drama_id))
+                        body = json.dumps({"success": info is not None, "info": info or "广播剧不存在"},
+                                          ensure_ascii=False).encode('utf-8')
+                    self._send(200, "application/json", body)
+                elif url.path == "/dramaapi/search":
+                    keyword = query.get("s", "")
+                    body = mock._fixture("search", f"{keyword}.json")
+                    if body is None:
+                        info = mock.search(keyword, int(query.get("page", 1)))
+                        body = json.dumps({"success": True, "info": info}, ensure_ascii=False).encode('utf-8')
+                    self._send(200, "application/json", body)
+                elif url.path == "/sound/getdm":
+                    sound_id = query.get("soundid", "")
+                    if sound_id.isdigit() and int(sound_id) in mock.failing_sound_ids:
+                        self._send(500, "text/plain", b"internal error")
+                        return
+                    body = mock._fixture("getdm", f"{sound_id}.xml") or mock.danmaku_xml(int(sound_id))
+                    etag = mock.danmaku_etag(body)
+                    if self.headers.get("If-None-Match") == etag:
+                        mock._count_not_modified()
+                        self._send(304, None, b"", {"ETag": etag})
+                    else:
+                        self._send(200, "text/xml; charset=utf-8", body, {"ETag": etag})
+                elif url.path.startswith("/cover/") and url.path.endswith(".png"):
+                    drama_id = int(url.path[len("/cover/"):-len(".png")])
+                    if drama_id in mock.drama_ids:
+                        self._send(200, "image/png", mock.cover_png(drama_id))
+                    else:
+                        self._send(404, "text/plain", b"not found")
+                else:
+                    self._send(404, "text/plain", b"not found")
+            except ValueError:
+                self._send(400, "text/plain", b"bad request")
+
+        def _send(self, status: int, content_type: Optional[str], body: bytes,
+                  headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            if content_type:
+                self.send_header("Content-Type", content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=1)
+                self.send_header("Content-Encoding", "gzip")
+            if status != 304:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            view = memoryview(body)
+            for start in range(0, len(body), RESPONSE_CHUNK_SIZE):
+                self.wfile.write(view[start:start + RESPONSE_CHUNK_SIZE])
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的猫耳FM接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--dramas", type=int, default=3)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--comments", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", help="录制的响应所在目录")
+    args = parser.parse_args()
+
+    mock = MockMissEvan(dramas=args.dramas, episodes=args.episodes, comments=args.comments,
+                        users=args.users, latency=args.latency, seed=args.seed, fixtures_dir=args.fixtures)
+    print(f"模拟服务地址: {mock.start(args.host, args.port)}")
+    print(f"广播剧ID: {', '.join(map(str, mock.drama_ids))}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器，根据上游响应状态自适应调整速率
+
+    收到 429 或 5xx 响应时按比例降低速率（并遵守 Retry-After），
+    之后每次正常响应逐步恢复，直到回到配置的最大速率。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 min_rate: float = 0.2, backoff_factor: float = 0.5,
+                 recovery_step: float = 0.05):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def _try_acquire(self) -> float:
+        """尝试取得一个令牌，成功时返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        if self.max_rate <= 0:
+            return
+        while True:
+            wait_time = self._try_acquire()
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    async def acquire_async(self):
+        """在事件循环中等待直到取得一个令牌，与 acquire 共享同一个桶"""
+        if self.max_rate <= 0:
+            return
+        while True:
+            wait_time = self._try_acquire()
+            if wait_time <= 0:
+                return
+            await asyncio.sleep(wait_time)
+
+    def on_response(self, status_code: int, retry_after: Optional[float] = None):
+        """根据响应状态码调整速率"""
+        if status_code == 429 or status_code >= 500:
+            self.backoff(retry_after)
+        else:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+    def backoff(self, retry_after: Optional[float] = None):
+        """降低速率，并在指定时间内暂停发放令牌"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（仅支持秒数格式）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,49 @@
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# 本地广播剧索引最多保存的条数
+DEFAULT_INDEX_SIZE = 10000
+
+
+def normalize_keyword(keyword: str) -> str:
+    """规范化搜索关键词：全角转半角、忽略大小写、合并空白"""
+    return ' '.join(unicodedata.normalize('NFKC', keyword).casefold().split())
+
+
+class DramaIndex:
+    """本地广播剧索引，记录搜索和统计过程中见过的广播剧ID、名称、作者和封面
+
+    按最近使用淘汰，用于不请求上游就能回答按ID的查询。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_INDEX_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, drama_id: int, name: Optional[str] = None, author: Optional[str] = None,
+            cover: Optional[str] = None):
+        """记录或更新一部广播剧的信息，缺失的字段保留原值"""
+        if not drama_id:
+            return
+        drama_id = int(drama_id)
+        with self._lock:
+            entry = self._entries.get(drama_id) or {'drama_id': drama_id}
+            for field, value in (('name', name), ('author', author), ('cover', cover)):
+                if value:
+                    entry[field] = value
+            self._entries[drama_id] = entry
+            self._entries.move_to_end(drama_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, drama_id: int) -> Optional[Dict]:
+        """按ID查找广播剧信息"""
+        with self._lock:
+            entry = self._entries.get(int(drama_id))
+            return dict(entry) if entry else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """合并对同一 key 的并发调用
+
+    同一时间每个 key 只执行一次函数，其余调用者等待并共享同一个结果（或异常）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行 fn(*args, **kwargs)，若相同 key 的调用正在进行则等待其结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的 asyncio 版本，只能在同一个事件循环中使用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Future"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """执行 await fn(*args, **kwargs)，若相同 key 的调用正在进行则等待其结果"""
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # 某个调用者被取消时不影响其他等待同一结果的调用者
+        return await asyncio.shield(future)
@@ -2,6 +2,7 @@ let currentDramaId = null;
 let isRunning = false;
 let selectedDramaId = null;
 let selectedDramaName = null;
+let progressSource = null;
 
 function searchDrama() {
     const searchInput = document.getElementById('searchInput');
@@ -123,8 +124,8 @@ function startCrawl() {
         if (data.error) {
             throw new Error(data.error);
         }
-        // 开始轮询进度
-        pollProgress();
+        // 订阅任务进度（加入已有任务时也从头接收进度）
+        streamProgress(data.job_id);
     })
     .catch(error => {
         document.getElementById('status').innerHTML = `<div class="alert alert-danger">${error.message}</div>`;
@@ -132,53 +133,51 @@ function startCrawl() {
     });
 }
 
-function pollProgress() {
-    if (!isRunning || !selectedDramaId) {
+function streamProgress(jobId) {
+    if (!isRunning || !jobId) {
         return;
     }
     
-    fetch(`/api/get_progress/${selectedDramaId}`)
-        .then(response => response.json())
-        .then(data => {
-            if (data.error) {
-                addLog('error', data.error);
+    // 服务端推送进度；断线后浏览器会带上 Last-Event-ID 自动续传
+    const source = new EventSource(`/api/jobs/${jobId}/events`);
+    progressSource = source;
+    
+    source.onmessage = event => {
+        const message = JSON.parse(event.data);
+        switch (message.status) {
+            case 'progress':
+                updateProgress(message);
+                break;
+            case 'error':
+                addLog('error', message.message);
+                break;
+            case 'no_paid_episodes':
+                addLog('error', message.message);
+                showNoPaidEpisodesError();
                 stopCrawl();
-                return;
-            }
-            
-            // 处理所有新消息
-            data.messages.forEach(message => {
-                switch (message.status) {
-                    case 'progress':
-                        updateProgress(message);
-                        break;
-                    case 'error':
-                        addLog('error', message.message);
-                        break;
-                    case 'no_paid_episodes':
-                        addLog('error', message.message);
-                        showNoPaidEpisodesError();
-                        stopCrawl();
-                        return;
-                    case 'complete':
-                        addLog('success', message.message);
-                        showFinalResult(message.message);
-                        stopCrawl();
-                        return;
-                    default:
-                        addLog('info', message.message);
-                }
-            });
-            
-            // 继续轮询
-            if (isRunning) {
-                setTimeout(pollProgress, 500);
-            }
-        })
-        .catch(error => {
-            addLog('error', '获取进度失败: ' + error);
+                break;
+            case 'complete':
+                addLog('success', message.message);
+                showFinalResult(message.message);
+                stopCrawl();
+                break;
+            default:
+                addLog('info', message.message);
+        }
+    };
+    
+    // 任务结束（包括出错或取消）
+    source.addEventListener('end', () => {
+        stopCrawl();
+    });
+    
+    source.onerror = () => {
+        // 连接被服务端拒绝（例如任务已被清理）时不再重连
+        if (source.readyState === EventSource.CLOSED) {
+            addLog('error', '获取进度失败');
             stopCrawl();
-        });
+        }
+    };
 }
 
 function updateProgress(data) {
@@ -242,6 +241,10 @@ function showNoPaidEpisodesError() {
 }
 
 function stopCrawl() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
+    }
     document.getElementById('searchButton').disabled = false;
     isRunning = false;
     selectedDramaId = null;
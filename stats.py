@@ -0,0 +1,213 @@
+import heapq
+import json
+import struct
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from hll import hash64
+from userset import UserIdSet
+
+# 视频时间热力图每格的秒数和最大格数，超出部分计入最后一格
+HEATMAP_BIN_SECONDS = 30
+HEATMAP_MAX_BINS = 240
+# 弹幕发送者排行榜保留的候选数和返回的条数
+TOP_SENDERS_CAPACITY = 1000
+TOP_SENDERS = 20
+# 统计用户覆盖分集数时最多保留的用户数，超出后按用户ID哈希采样
+COVERAGE_SAMPLE_SIZE = 65536
+
+
+class HeavyHitters:
+    """Misra-Gries 高频项摘要，只保留 capacity 个候选项
+
+    计数为下界，真实值不超过 计数 + error；两个摘要可以合并，
+    因此可以逐分集批量加入精确计数而不必保存所有用户的计数。
+    """
+
+    def __init__(self, capacity: int = TOP_SENDERS_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[int, int] = {}
+        self.error = 0
+
+    def update(self, counts: Mapping[int, int]):
+        """批量加入 {项: 次数}，超出容量时减去第 capacity+1 大的计数并丢弃不再为正的项"""
+        merged = self.counts
+        for item, count in counts.items():
+            merged[item] = merged.get(item, 0) + count
+        if len(merged) > self.capacity:
+            threshold = heapq.nlargest(self.capacity + 1, merged.values())[-1]
+            self.error += threshold
+            self.counts = {item: count - threshold for item, count in merged.items() if count > threshold}
+
+    def top(self, n: int) -> List[Tuple[int, int]]:
+        """返回计数最大的 n 项 [(项, 计数)]"""
+        return heapq.nlargest(n, self.counts.items(), key=lambda entry: entry[1])
+
+
+class CoverageSample:
+    """用户覆盖分集数的自适应哈希采样，最多保留 capacity 个用户的计数
+
+    只统计哈希值最高 level 位为 0 的用户，超出容量时 level 加一并丢弃不再满足的用户，
+    每个保留的用户代表 2^level 个用户；同一用户在所有分集中的取舍一致，因此其计数是精确的。
+    用户数不超过 capacity 时（level 为 0）结果是精确值。
+    """
+
+    def __init__(self, capacity: int = COVERAGE_SAMPLE_SIZE):
+        self.capacity = capacity
+        self.level = 0
+        self.counts: Dict[int, int] = {}
+
+    def _sampled(self, user_id: int) -> bool:
+        return self.level == 0 or hash64(user_id) >> (64 - self.level) == 0
+
+    def update(self, user_ids: Iterable[int]):
+        """加入一个分集的（不重复）用户"""
+        counts = self.counts
+        if self.level == 0:
+            for user_id in user_ids:
+                counts[user_id] = counts.get(user_id, 0) + 1
+        else:
+            for user_id in user_ids:
+                if hash64(user_id) >> (64 - self.level) == 0:
+                    counts[user_id] = counts.get(user_id, 0) + 1
+        while len(self.counts) > self.capacity:
+            self.level += 1
+            self.counts = {user_id: count for user_id, count in self.counts.items() if self._sampled(user_id)}
+
+    @property
+    def approximate(self) -> bool:
+        return self.level > 0
+
+    def distribution(self) -> Dict[int, int]:
+        """返回 {分集数 k: 评论过 k 个分集的用户数}，采样时为按比例放大的估计值"""
+        scale = 1 << self.level
+        return {k: n * scale for k, n in sorted(Counter(self.counts.values()).items())}
+
+
+class EpisodeStats:
+    """单个分集的弹幕统计，在解析弹幕XML时逐条累计
+
+    记录弹幕总数、视频时间热力图和每个用户的弹幕数。
+    """
+
+    def __init__(self):
+        self.comments = 0
+        self.heatmap: List[int] = []
+        self._senders: Counter = Counter()
+        self.user_ids = UserIdSet()
+        self.comment_counts = array('q')  # 与 user_ids 一一对应的弹幕数
+
+    def add(self, stime: float, user_id: int):
+        """加入一条弹幕：出现在视频中的秒数和发送者ID"""
+        self.comments += 1
+        self._senders[user_id] += 1
+        index = min(max(int(stime // HEATMAP_BIN_SECONDS), 0), HEATMAP_MAX_BINS - 1)
+        if index >= len(self.heatmap):
+            self.heatmap.extend([0] * (index + 1 - len(self.heatmap)))
+        self.heatmap[index] += 1
+
+    def finish(self) -> "EpisodeStats":
+        """解析结束后把按用户的计数整理为与 user_ids 对齐的数组"""
+        if self._senders:
+            senders = sorted(self._senders.items())
+            self.user_ids = UserIdSet.from_sorted(user_id for user_id, _ in senders)
+            self.comment_counts = array('q', (count for _, count in senders))
+            self._senders = Counter()
+        return self
+
+    def senders(self) -> Dict[int, int]:
+        """返回 {用户ID: 弹幕数}"""
+        return dict(zip(self.user_ids, self.comment_counts))
+
+    def to_dict(self) -> Dict:
+        return {
+            'comments': self.comments,
+            'heatmap': self.heatmap,
+            'user_ids': list(self.user_ids),
+            'comment_counts': list(self.comment_counts)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "EpisodeStats":
+        stats = cls()
+        stats.comments = data['comments']
+        stats.heatmap = list(data['heatmap'])
+        stats.user_ids = UserIdSet.from_sorted(data['user_ids'])
+        stats.comment_counts = array('q', data['comment_counts'])
+        return stats
+
+    def to_bytes(self) -> bytes:
+        """序列化为 bytes，用于缓存：4 字节的头长度、JSON 头（弹幕数和热力图）、
+        用户ID和对应弹幕数的原始 int64 字节（两段等长）"""
+        header = json.dumps({'comments': self.comments, 'heatmap': self.heatmap},
+                            separators=(',', ':')).encode('utf-8')
+        return struct.pack('<I', len(header)) + header + self.user_ids.to_bytes() + self.comment_counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "EpisodeStats":
+        """从 to_bytes 的结果还原"""
+        size = struct.unpack_from('<I', data)[0]
+        header = json.loads(data[4:4 + size])
+        body = memoryview(data)[4 + size:]
+        half = len(body) // 2
+        stats = cls()
+        stats.comments = header['comments']
+        stats.heatmap = header['heatmap']
+        stats.user_ids = UserIdSet.from_bytes(body[:half])
+        stats.comment_counts.frombytes(body[half:])
+        return stats
+
+
+class DramaStats:
+    """把各分集的统计汇总为一部广播剧的统计
+
+    包括每集弹幕数和用户数、弹幕最多的用户（高频项摘要，内存有上限）、
+    用户覆盖的分集数分布（评论过 k 集的用户数，用户很多时为采样估计，内存同样有上限），
+    以及合计的视频时间热力图。
+    """
+
+    def __init__(self, top_capacity: int = TOP_SENDERS_CAPACITY,
+                 coverage_capacity: int = COVERAGE_SAMPLE_SIZE):
+        self.episodes: List[Dict] = []
+        self.heatmap: List[int] = []
+        self.top_senders = HeavyHitters(top_capacity)
+        self._coverage = CoverageSample(coverage_capacity)
+
+    def add(self, episode: Dict, stats: EpisodeStats):
+        """加入一个分集的统计"""
+        self.episodes.append({
+            'sound_id': episode.get('sound_id'),
+            'name': episode.get('name'),
+            'comments': stats.comments,
+            'unique_users': len(stats.user_ids),
+            'heatmap': stats.heatmap
+        })
+        if len(stats.heatmap) > len(self.heatmap):
+            self.heatmap.extend([0] * (len(stats.heatmap) - len(self.heatmap)))
+        for index, count in enumerate(stats.heatmap):
+            self.heatmap[index] += count
+        self.top_senders.update(stats.senders())
+        self._coverage.update(stats.user_ids)
+
+    def coverage(self) -> Dict[int, int]:
+        """返回 {分集数 k: 评论过 k 个分集的用户数}"""
+        return self._coverage.distribution()
+
+    def to_dict(self, top: int = TOP_SENDERS, sound_ids: Optional[Iterable[int]] = None) -> Dict:
+        """汇总结果；指定 sound_ids 时按该顺序排列各分集"""
+        episodes = self.episodes
+        if sound_ids is not None:
+            order = {sound_id: i for i, sound_id in enumerate(sound_ids)}
+            episodes = sorted(episodes, key=lambda ep: order.get(ep['sound_id'], len(order)))
+        return {
+            'episodes': episodes,
+            'comments': sum(ep['comments'] for ep in episodes),
+            'heatmap_bin_seconds': HEATMAP_BIN_SECONDS,
+            'heatmap': self.heatmap,
+            'top_senders': [{'user_id': user_id, 'comments': count}
+                            for user_id, count in self.top_senders.top(top)],
+            'top_senders_error': self.top_senders.error,
+            'coverage': self.coverage(),
+            'coverage_approximate': self._coverage.approximate
+        }
@@ -0,0 +1,127 @@
+"""去重集合、估计器和统计摘要的单元测试，不需要网络"""
+import random
+from collections import Counter
+
+import pytest
+
+import userset
+from hll import HyperLogLog
+from stats import CoverageSample, DramaStats, EpisodeStats
+from userset import UserIdSet
+
+
+def random_episodes(count, users_per_episode, users, seed=0):
+    rng = random.Random(seed)
+    return [sorted({rng.randint(1, users) for _ in range(users_per_episode)}) for _ in range(count)]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def merge_backend(request, monkeypatch):
+    """分别测试 numpy 和纯 Python 的归并实现"""
+    if request.param == "numpy":
+        if userset.np is None:
+            pytest.skip("numpy 未安装")
+    else:
+        monkeypatch.setattr(userset, "np", None)
+    return request.param
+
+
+def test_user_id_set_matches_python_set(merge_backend, monkeypatch):
+    monkeypatch.setattr(userset, "MIN_PENDING_SIZE", 64)  # 让测试数据触发多次归并
+    rng = random.Random(1)
+    a, b = UserIdSet(), UserIdSet()
+    expected_a, expected_b = set(), set()
+    for _ in range(3000):
+        value = rng.randint(-500, 5000)
+        a.add(value)
+        expected_a.add(value)
+    batch = [rng.randint(0, 8000) for _ in range(2000)]
+    b.update(batch)
+    expected_b.update(batch)
+
+    assert len(a) == len(expected_a) and list(a) == sorted(expected_a)
+    assert list(a | b) == sorted(expected_a | expected_b)
+    assert list(a & b) == sorted(expected_a & expected_b)
+    assert 42 in b or 42 not in expected_b
+    assert all(value in a for value in list(expected_a)[:100])
+    assert -501 not in a
+
+    merged = UserIdSet.from_sorted(a)
+    merged.update(b)
+    assert merged == a | b
+    assert UserIdSet.from_bytes(merged.to_bytes()) == merged
+
+
+def test_hyperloglog_accuracy_and_merge():
+    a, b = HyperLogLog(12), HyperLogLog(12)
+    a.update(range(0, 60000))
+    b.update(range(40000, 100000))
+    a.add(5)  # 重复元素不影响估计
+
+    # 误差在 3 倍标准误差内，10 万个不同的值只占 4KB
+    assert abs(a.count() - 60000) <= 3 * a.error_bound * 60000
+    merged = HyperLogLog.from_bytes(a.to_bytes())
+    merged.update(b)
+    assert abs(merged.count() - 100000) <= 3 * merged.error_bound * 100000
+
+    # 合并结果与直接统计并集完全相同
+    union = HyperLogLog(12)
+    union.update(range(0, 100000))
+    assert merged.registers == union.registers
+
+    assert len(HyperLogLog.from_bytes(HyperLogLog(12).to_bytes())) == 0
+    small = HyperLogLog(12)
+    small.update(range(100))
+    assert abs(len(small) - 100) <= 5  # 基数很小时使用线性计数，误差很小
+
+    with pytest.raises(ValueError):
+        a.update(HyperLogLog(10))
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(a.to_bytes()[:-1])
+
+
+def exact_coverage(episodes):
+    seen = Counter()
+    for user_ids in episodes:
+        seen.update(user_ids)
+    return dict(sorted(Counter(seen.values()).items()))
+
+
+def test_episode_stats_serialization():
+    rng = random.Random(3)
+    stats = EpisodeStats()
+    for _ in range(5000):
+        stats.add(rng.uniform(0, 3600), rng.randint(1, 800))
+    stats.finish()
+
+    # 缓存中的字节格式，以及旧版本缓存的 JSON 字典格式
+    for restored in (EpisodeStats.from_bytes(stats.to_bytes()), EpisodeStats.from_dict(stats.to_dict())):
+        assert restored.comments == stats.comments and restored.heatmap == stats.heatmap
+        assert restored.senders() == stats.senders()
+    empty = EpisodeStats.from_bytes(EpisodeStats().finish().to_bytes())
+    assert empty.comments == 0 and len(empty.user_ids) == 0 and not empty.comment_counts
+
+
+def test_coverage_is_exact_below_capacity():
+    episodes = random_episodes(6, 2000, 5000)
+    stats = DramaStats()
+    for i, user_ids in enumerate(episodes):
+        episode = EpisodeStats()
+        for user_id in user_ids:
+            episode.add(0, user_id)
+        stats.add({'sound_id': i}, episode.finish())
+    result = stats.to_dict()
+    assert result['coverage'] == exact_coverage(episodes)
+    assert not result['coverage_approximate']
+
+
+def test_coverage_sample_stays_bounded():
+    episodes = random_episodes(8, 30000, 100000)
+    sample = CoverageSample(capacity=4096)
+    for user_ids in episodes:
+        sample.update(user_ids)
+        assert len(sample.counts) <= 4096
+    assert sample.approximate
+    estimated = sum(sample.distribution().values())
+    exact = sum(exact_coverage(episodes).values())
+    assert abs(estimated - exact) / exact < 0.1
@@ -0,0 +1,272 @@
+"""使用本地模拟接口的离线测试，不需要访问猫耳FM"""
+import gc
+import threading
+import time
+import weakref
+
+import pytest
+import requests
+
+import crawler as crawler_module
+from cache import DiskCache
+from checkpoint import CrawlCheckpoint
+from crawler import MissEvanCrawler, pack_danmaku_state, unpack_danmaku_state
+from mock_missevan import MockMissEvan
+from userset import UserIdSet
+
+
+@pytest.fixture(scope="module")
+def mock():
+    with MockMissEvan(dramas=2, episodes=4, comments=300, users=200) as server:
+        yield server
+
+
+def new_crawler(mock, cache=None):
+    return MissEvanCrawler(requests_per_second=1000, burst=1000, cache=cache, base_url=mock.base_url)
+
+
+def test_crawl_counts_unique_users(mock):
+    crawler = new_crawler(mock)
+    drama_id = mock.drama_ids[0]
+    episodes = crawler.get_drama_sounds(drama_id)
+    assert [ep["sound_id"] for ep in episodes] == mock.paid_sound_ids(drama_id)
+
+    total = set()
+    for _, episode, user_ids, _ in crawler.iter_episode_danmaku(episodes, max_workers=2):
+        assert set(user_ids) == mock.unique_users([episode["sound_id"]])
+        total.update(user_ids)
+    assert total == mock.unique_users(mock.paid_sound_ids(drama_id))
+
+
+def test_crawled_episode_sets_are_released(mock):
+    crawler = new_crawler(mock)
+    episodes = crawler.get_drama_sounds(mock.drama_ids[0])
+    refs = []
+    for _, _, user_ids, _ in crawler.iter_episode_danmaku(episodes, max_workers=2):
+        refs.append(weakref.ref(user_ids))
+        del user_ids
+        gc.collect()
+        # 迭代器不再保留已返回的分集结果，只有最近一个可能仍被引用
+        assert sum(ref() is not None for ref in refs) <= 1
+
+
+def test_batch_crawl_merges_dramas(mock):
+    result = new_crawler(mock).crawl_dramas(mock.drama_ids, max_workers=2)
+    all_sound_ids = [sound_id for drama_id in mock.drama_ids for sound_id in mock.paid_sound_ids(drama_id)]
+    assert result["episodes"] == len(all_sound_ids)
+    assert result["unique_users"] == len(mock.unique_users(all_sound_ids))
+    assert result["failed_episodes"] == 0
+
+
+def test_batch_crawl_reports_failed_episodes(mock, monkeypatch):
+    failing = mock.paid_sound_ids(mock.drama_ids[1])[0]
+    monkeypatch.setattr(mock, "failing_sound_ids", {failing})
+    result = new_crawler(mock).crawl_dramas(mock.drama_ids, max_workers=2)
+    assert result["failed_episodes"] == 1
+    assert [drama["failed_episodes"] for drama in result["dramas"]] == [0, 1]
+
+
+def test_danmaku_ids_are_cached(mock, tmp_path):
+    crawler = new_crawler(mock, cache=DiskCache(str(tmp_path / "cache.sqlite3")))
+    sound_id = mock.paid_sound_ids(mock.drama_ids[0])[0]
+    before = mock.requests.get("/sound/getdm", 0)
+    first = crawler.get_danmaku_ids(sound_id)
+    second = crawler.get_danmaku_ids(sound_id)
+    assert first == second
+    assert mock.requests["/sound/getdm"] - before == 1
+
+
+def test_search_uses_cache_for_refinements(mock):
+    crawler = new_crawler(mock)
+    results = crawler.search_drama("模拟")
+    assert sorted(drama["drama_id"] for drama in results) == mock.drama_ids
+
+    before = mock.requests["/dramaapi/search"]
+    refined = crawler.search_drama(f"模拟广播剧{mock.drama_ids[1]}")
+    assert [drama["drama_id"] for drama in refined] == [mock.drama_ids[1]]
+    assert mock.requests["/dramaapi/search"] == before
+
+
+def test_danmaku_stats(mock):
+    sound_id = mock.paid_sound_ids(mock.drama_ids[0])[0]
+    stats = new_crawler(mock).get_danmaku_stats(sound_id)
+    assert stats.comments == mock.comments
+    assert sum(stats.heatmap) == mock.comments
+    assert sum(stats.comment_counts) == mock.comments
+    assert set(stats.user_ids) == mock.unique_users([sound_id])
+
+
+def test_unavailable_responses_are_retried_through_rate_limiter(mock, monkeypatch):
+    monkeypatch.setattr(crawler_module, "RETRY_BACKOFF_FACTOR", 0)
+    monkeypatch.setattr(crawler_module, "RETRY_BACKOFF_JITTER", 0)
+    crawler = new_crawler(mock)
+    acquired = []
+    acquire = crawler.rate_limiter.acquire
+    monkeypatch.setattr(crawler.rate_limiter, "acquire", lambda: acquired.append(1) or acquire())
+    responses = []
+    on_response = crawler.rate_limiter.on_response
+    monkeypatch.setattr(crawler.rate_limiter, "on_response",
+                        lambda status, retry_after=None: responses.append(status) or on_response(status, retry_after))
+
+    before = mock.requests.get("/dramaapi/getdrama", 0)
+    mock.unavailable = 2
+    assert crawler.get_drama_info(mock.drama_ids[0]) is not None
+    # 每次重试都经过限流器，限流器也看到了每个 503
+    assert mock.requests["/dramaapi/getdrama"] - before == 3
+    assert len(acquired) == 3 and responses == [503, 503, 200]
+
+    # 超过重试次数后返回最后一次的响应
+    mock.unavailable = crawler.retries + 1
+    assert crawler.get(f"{mock.base_url}/dramaapi/getdrama?drama_id={mock.drama_ids[1]}").status_code == 503
+    assert mock.unavailable == 0
+
+
+def test_dropped_connections_are_retried(mock, monkeypatch):
+    monkeypatch.setattr(crawler_module, "RETRY_BACKOFF_FACTOR", 0)
+    monkeypatch.setattr(crawler_module, "RETRY_BACKOFF_JITTER", 0)
+    crawler = new_crawler(mock)
+    acquired = []
+    acquire = crawler.rate_limiter.acquire
+    monkeypatch.setattr(crawler.rate_limiter, "acquire", lambda: acquired.append(1) or acquire())
+
+    # 连接在响应前被断开（如复用了已被上游关闭的长连接）时经过限流器重试
+    mock.dropped = 2
+    assert crawler.get_drama_info(mock.drama_ids[0]) is not None
+    assert len(acquired) == 3 and mock.dropped == 0
+
+    mock.dropped = crawler.retries + 1
+    with pytest.raises(requests.exceptions.ConnectionError):
+        crawler.get(f"{mock.base_url}/dramaapi/getdrama?drama_id={mock.drama_ids[1]}")
+    assert mock.dropped == 0
+
+    # 建立连接失败已由 urllib3 重试过，不再重复重试
+    acquired.clear()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        crawler.get("http://127.0.0.1:9/")
+    assert len(acquired) == 1
+
+
+def test_export_keeps_a_bounded_window_of_episodes(mock, tmp_path, monkeypatch):
+    crawler = new_crawler(mock)
+    episodes = [episode for drama_id in mock.drama_ids for episode in crawler.get_drama_sounds(drama_id)]
+    failing = episodes[1]["sound_id"]
+    monkeypatch.setattr(mock, "failing_sound_ids", {failing})
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+    fetch = crawler._fetch_danmaku_columns
+
+    def counting_fetch(sound_id, with_text=False):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        return fetch(sound_id, with_text)
+
+    def on_episode(done, total, episode):
+        time.sleep(0.05)  # 写入比抓取慢时，抓取也不会跑到写入前面太多
+        with lock:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(crawler, "_fetch_danmaku_columns", counting_fetch)
+    meta = crawler.export_danmaku(episodes, str(tmp_path / "export"), max_workers=2, on_episode=on_episode)
+    # 抓取中和已抓取但尚未写入的分集不超过并发数加上正在写入的一个
+    assert peak[0] <= 3
+    assert meta["failed"] == [failing]
+    assert meta["rows"] == mock.comments * (len(episodes) - 1)
+
+
+def test_unchanged_danmaku_revalidated_with_etag(mock, tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"))
+    crawler = new_crawler(mock, cache=cache)
+    sound_id = mock.paid_sound_ids(mock.drama_ids[1])[0]
+    first = crawler.get_danmaku_ids(sound_id)
+
+    # 让缓存过期，重新抓取时应发送条件请求并沿用已有的用户集合
+    state, user_ids = unpack_danmaku_state(cache.get(f"danmaku:{sound_id}"))
+    assert state["etag"]
+    assert user_ids == first
+    state["fetched_at"] = 0
+    cache.set(f"danmaku:{sound_id}", pack_danmaku_state(state, user_ids))
+    before = mock.not_modified
+    assert crawler.get_danmaku_ids(sound_id) == first
+    assert mock.not_modified == before + 1
+    assert unpack_danmaku_state(cache.get(f"danmaku:{sound_id}"))[0]["fetched_at"] > 0
+
+
+def test_cover_thumbnail_is_cached(mock, tmp_path, monkeypatch):
+    crawler = new_crawler(mock, cache=DiskCache(str(tmp_path / "cache.sqlite3")))
+    drama_id = mock.drama_ids[0]
+    crawler.get_drama_info(drama_id)
+    # 封面使用独立的限流器，不占用接口的请求配额
+    acquired = []
+    acquire = crawler.rate_limiter.acquire
+    monkeypatch.setattr(crawler.rate_limiter, "acquire", lambda: acquired.append(1) or acquire())
+    data, content_type = crawler.get_cover_thumbnail(drama_id)
+    assert not acquired
+    assert content_type in ("image/jpeg", "image/png")
+    assert len(data) <= len(mock.cover_png(drama_id))
+
+    before = mock.requests[f"/cover/{drama_id}.png"]
+    assert crawler.get_cover_thumbnail(drama_id) == (data, content_type)
+    assert mock.requests[f"/cover/{drama_id}.png"] == before
+    assert crawler.get_cover_thumbnail(mock.drama_ids[-1] + 1) is None
+
+
+def test_async_crawler_shares_caches(mock):
+    pytest.importorskip("httpx")
+    import asyncio
+    from async_crawler import AsyncMissEvanCrawler
+
+    crawler = new_crawler(mock)
+
+    async def run():
+        async_crawler = AsyncMissEvanCrawler(crawler)
+        try:
+            results = await asyncio.gather(*(async_crawler.search_drama("模拟") for _ in range(5)))
+            cover = await async_crawler.get_cover_thumbnail(mock.drama_ids[0])
+        finally:
+            await async_crawler.aclose()
+        return results, cover
+
+    before = mock.requests["/dramaapi/search"]
+    results, cover = asyncio.run(run())
+    assert mock.requests["/dramaapi/search"] == before + 1
+    assert all(sorted(drama["drama_id"] for drama in result) == mock.drama_ids for result in results)
+    assert crawler.search_drama("模拟") == results[0]
+    assert cover is not None
+
+
+def test_empty_prefix_refinement_falls_through_to_upstream(mock):
+    crawler = new_crawler(mock)
+    crawler.search_drama("模拟")
+    before = mock.requests["/dramaapi/search"]
+    assert crawler.search_drama("模拟不存在") == []
+    assert mock.requests["/dramaapi/search"] == before + 1
+
+
+def test_failed_episodes_are_flagged_and_resumed_from_checkpoint(mock, tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"))
+    crawler = MissEvanCrawler(requests_per_second=1000, burst=1000, cache=cache, base_url=mock.base_url,
+                              retries=0)
+    episodes = crawler.get_drama_sounds(mock.drama_ids[0])
+    failing = episodes[1]["sound_id"]
+    mock.failing_sound_ids.add(failing)
+    try:
+        checkpoint = CrawlCheckpoint(cache, "test")
+        total = UserIdSet()
+        for _, episode, user_ids, fetched in crawler.iter_episode_danmaku(episodes, max_workers=2):
+            assert fetched == (episode["sound_id"] != failing)
+            total.update(user_ids)
+            if fetched:
+                checkpoint.record(episode["sound_id"], total)
+        checkpoint.save(total)
+    finally:
+        mock.failing_sound_ids.discard(failing)
+
+    # 恢复时只剩失败的分集需要抓取，补上后与完整统计一致
+    done, total = CrawlCheckpoint(cache, "test").load(UserIdSet())
+    pending = [ep for ep in episodes if ep["sound_id"] not in done]
+    assert [ep["sound_id"] for ep in pending] == [failing]
+    for _, _, user_ids, fetched in crawler.iter_episode_danmaku(pending):
+        assert fetched
+        total.update(user_ids)
+    assert set(total) == mock.unique_users([ep["sound_id"] for ep in episodes])
@@ -0,0 +1,198 @@
+"""任务存储和调度器的测试，两个 SQLiteJobStore 实例共用一个文件，模拟多个 worker 进程"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from jobs import (CANCELLED, DONE, FAILED, RUNNING, STALE_AFTER, JobCancelled, JobQueueFull, JobScheduler,
+                  SQLiteJobStore)
+
+
+@pytest.fixture
+def stores(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    return SQLiteJobStore(path, buffer_size=5), SQLiteJobStore(path, buffer_size=5)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_same_key_is_deduplicated_across_stores(stores):
+    a, b = stores
+    key, group = ('drama', 1, 14, False, False), ('drama', 1)
+    job_id, created = a.create(key, group)
+    assert created
+    assert b.create(key, group) == (job_id, False)
+    assert b.find(key) == job_id and b.find_group(group) == job_id
+
+    # 不同选项的任务单独新建，组内最近的任务随之更新
+    other_id, created = b.create(('drama', 1, 14, True, False), group)
+    assert created and other_id != job_id
+    assert a.find_group(group) == other_id
+
+    # 多个实例同时新建同一 key，只会新建一个任务
+    results = []
+    barrier = threading.Barrier(8)
+
+    def create(store):
+        barrier.wait()
+        results.append(store.create(('drama', 2), None))
+    threads = [threading.Thread(target=create, args=(stores[i % 2],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({job_id for job_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+
+
+def test_messages_are_trimmed_and_replayed_from_cursor(stores):
+    a, b = stores
+    job_id, _ = a.create(None)
+    for i in range(12):
+        a.append(job_id, {'i': i})
+
+    # 只保留最近 5 条，游标落在已丢弃的消息上时从最早保留的一条开始
+    messages, cursor = b.read(job_id, 0)
+    assert [m['i'] for m in messages] == [7, 8, 9, 10, 11] and cursor == 12
+    messages, cursor = b.read(job_id, 10)
+    assert [m['i'] for m in messages] == [10, 11] and cursor == 12
+    assert b.read(job_id, 12) == ([], 12)
+
+    b.append(job_id, {'i': 12})
+    assert a.wait(job_id, 12, timeout=1) == ([{'i': 12}], 13)
+    with sqlite3.connect(a.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM job_messages").fetchone()[0] == 5
+
+
+def test_cancel_from_another_store(stores):
+    a, b = stores
+    scheduler = JobScheduler(max_workers=1, store=a)
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job, created = scheduler.submit(run, key='slow')
+    assert created
+    assert started.wait(5)
+    assert b.get(job.id)['status'] == RUNNING
+    assert b.cancel(job.id)
+    wait_until(lambda: job.finished)
+    assert job.status == CANCELLED and job.cancelled
+    assert not b.cancel(job.id)  # 已结束的任务不能再取消
+
+    # 等待中的任务被取消后直接结束，不会再执行
+    pending_id, _ = a.create('pending')
+    assert b.cancel(pending_id)
+    assert not a.start(pending_id)
+    assert a.get(pending_id)['status'] == CANCELLED
+
+
+def test_scheduler_joins_job_submitted_by_another_process(stores):
+    a, b = stores
+    release = threading.Event()
+    calls = []
+
+    def run(job):
+        calls.append(job.id)
+        job.put({'progress': 1})
+        release.wait(5)
+        return {'unique_users': 3}
+
+    job, created = JobScheduler(store=a).submit(run, key='shared', group='g')
+    joined, joined_created = JobScheduler(store=b).submit(run, key='shared', group='g')
+    assert created and not joined_created and joined.id == job.id
+
+    messages, cursor = joined.wait(0, timeout=5)
+    assert messages == [{'progress': 1}] and cursor == 1
+    release.set()
+    wait_until(lambda: joined.finished)
+    assert joined.status == DONE and joined.result == {'unique_users': 3}
+    assert calls == [job.id]
+
+
+def test_stale_job_is_failed_and_replaced(stores):
+    a, b = stores
+    job_id, _ = a.create('stale')
+    a.start(job_id)
+
+    # 模拟执行任务的进程退出：心跳停止超过 STALE_AFTER 秒
+    with sqlite3.connect(a.path) as conn:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - STALE_AFTER - 1, job_id))
+    # 其他进程查询时立即按失败返回，等待进度的客户端不会一直等下去
+    assert b.get(job_id)['status'] == FAILED
+    assert b.wait(job_id, 0, timeout=None) == ([], 0)
+    b.fail_stale()
+    with sqlite3.connect(a.path) as conn:
+        assert conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == FAILED
+    new_id, created = b.create('stale')
+    assert created and new_id != job_id
+    assert a.get(job_id)['status'] == FAILED
+
+    # 刷新过心跳的任务不会被判定为失败
+    b.touch([new_id])
+    assert a.create('stale') == (new_id, False)
+
+
+def test_finished_jobs_are_cleaned_up_after_ttl(stores):
+    a, b = stores
+    old_id, _ = a.create('old')
+    a.append(old_id, {'i': 0})
+    a.update(old_id, status=DONE, finished_at=time.time() - 60)
+    recent_id, _ = a.create('recent')
+    a.update(recent_id, status=DONE, finished_at=time.time())
+    running_id, _ = a.create('running')
+
+    b.cleanup(finished_ttl=30)
+    assert a.get(old_id) is None and a.find('old') is None
+    assert a.read(old_id, 0) == ([], 0)
+    assert a.get(recent_id) is not None and a.get(running_id) is not None
+    with sqlite3.connect(a.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM job_messages WHERE job_id = ?", (old_id,)).fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_cancelled_pending_jobs_free_queue_slots(stores, backend):
+    a, b = stores
+    scheduler = JobScheduler(max_workers=1, max_pending=2, store=a if backend == "sqlite" else None)
+    release = threading.Event()
+    running, _ = scheduler.submit(lambda job: release.wait(5))
+    wait_until(lambda: running.status == RUNNING)
+
+    first, _ = scheduler.submit(lambda job: None)
+    second, _ = scheduler.submit(lambda job: None)
+    with pytest.raises(JobQueueFull):
+        scheduler.submit(lambda job: None)
+
+    # 本进程取消的任务立即让出名额，其他进程取消的任务在队列满时重新检查
+    assert scheduler.cancel(first.id)
+    if backend == "sqlite":
+        assert b.cancel(second.id)
+    else:
+        assert scheduler.cancel(second.id)
+    third, created = scheduler.submit(lambda job: 3)
+    assert created and scheduler.pending_count <= 2
+    release.set()
+    wait_until(lambda: third.finished)
+    assert third.result == 3 and first.status == second.status == CANCELLED
+    assert scheduler.pending_count == 0
+
+
+def test_job_cancelled_exception_marks_job_cancelled(stores):
+    a, _ = stores
+
+    def run(job):
+        raise JobCancelled()
+
+    job, _ = JobScheduler(store=a).submit(run)
+    wait_until(lambda: job.finished)
+    assert job.status == CANCELLED
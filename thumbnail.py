@@ -0,0 +1,58 @@
+import io
+from typing import Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 为可选依赖，缺失时原样保存封面
+    Image = None
+
+# 缩略图的最长边（像素），搜索结果中封面显示为 60x80，按 2 倍屏留出余量
+THUMBNAIL_SIZE = 160
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_AVAILABLE = Image is not None
+
+# 按文件头识别的图片类型
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def image_content_type(data: bytes) -> str:
+    """根据文件头判断图片的 Content-Type，无法识别时返回 application/octet-stream"""
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def make_thumbnail(data: bytes, size: int = THUMBNAIL_SIZE) -> Tuple[bytes, str]:
+    """把图片缩小到最长边不超过 size 并编码为 JPEG，返回 (图片数据, Content-Type)
+
+    没有安装 Pillow、图片无法解码或缩小后反而更大时返回原图。
+    """
+    if Image is None:
+        return data, image_content_type(data)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEG 解码时直接按 1/2、1/4、1/8 缩小，比解码全图后再缩放快得多
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    except (OSError, ValueError) as e:
+        print(f"生成封面缩略图失败: {e}")
+        return data, image_content_type(data)
+    thumbnail = output.getvalue()
+    if len(thumbnail) >= len(data):
+        return data, image_content_type(data)
+    return thumbnail, 'image/jpeg'
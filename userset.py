@@ -0,0 +1,137 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Iterable, Iterator, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时使用纯 Python 实现
+    np = None
+
+# 待合并缓冲区的最小容量，实际容量随集合大小增长以摊薄合并开销
+MIN_PENDING_SIZE = 1 << 16
+
+
+def _merge_sorted(a: array, b: array) -> array:
+    """合并两个升序且无重复的 int64 数组，返回升序无重复的新数组"""
+    if not a:
+        return array('q', b)
+    if not b:
+        return array('q', a)
+    if np is not None:
+        # 在 a 中二分定位 b 的每个元素，只把 a 中没有的插入到对应位置
+        na, nb = np.frombuffer(a, dtype=np.int64), np.frombuffer(b, dtype=np.int64)
+        pos = np.searchsorted(na, nb)
+        is_new = (pos == len(na)) | (na[np.minimum(pos, len(na) - 1)] != nb)
+        merged = np.insert(na, pos[is_new], nb[is_new])
+        result = array('q')
+        result.frombytes(merged.tobytes())
+        return result
+    # 先去掉 a 中已有的元素，sorted 对两段有序序列的拼接只做一次线性归并
+    n = len(a)
+    new = [x for x in b if (i := bisect_left(a, x)) >= n or a[i] != x]
+    return array('q', sorted(chain(a, new)))
+
+
+class UserIdSet:
+    """紧凑的用户ID集合，以升序 int64 数组存储
+
+    每个ID只占 8 字节（Python set 约 60 字节以上），支持精确的去重计数、
+    并集和交集。新加入的ID先放入缓冲区，查询或缓冲区满时批量归并。
+    """
+
+    def __init__(self, ids: Optional[Iterable[int]] = None):
+        self._data = array('q')
+        self._pending = set()
+        if ids is not None:
+            self.update(ids)
+
+    @classmethod
+    def from_sorted(cls, ids: Iterable[int]) -> "UserIdSet":
+        """从已经升序且无重复的ID序列构造，跳过排序和去重"""
+        result = cls()
+        result._data = array('q', ids)
+        return result
+
+    def add(self, user_id: int):
+        """加入一个用户ID"""
+        self._pending.add(user_id)
+        if len(self._pending) >= max(MIN_PENDING_SIZE, len(self._data) // 2):
+            self._flush()
+
+    def update(self, ids: Iterable[int]):
+        """批量加入用户ID，可以是另一个 UserIdSet"""
+        if isinstance(ids, UserIdSet):
+            ids._flush()
+            self._data = _merge_sorted(self._data, ids._data)
+            return
+        self._pending.update(ids)
+        if len(self._pending) >= max(MIN_PENDING_SIZE, len(self._data) // 2):
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._data = _merge_sorted(self._data, array('q', sorted(self._pending)))
+            self._pending = set()
+
+    def union(self, other: "UserIdSet") -> "UserIdSet":
+        """返回两个集合的并集"""
+        result = UserIdSet.from_sorted(self._sorted())
+        result.update(other)
+        return result
+
+    def intersection(self, other: "UserIdSet") -> "UserIdSet":
+        """返回两个集合的交集"""
+        a, b = self._sorted(), other._sorted()
+        if len(a) > len(b):
+            a, b = b, a
+        if np is not None and a:
+            common = np.intersect1d(np.frombuffer(a, dtype=np.int64), np.frombuffer(b, dtype=np.int64),
+                                    assume_unique=True)
+            result = UserIdSet()
+            result._data.frombytes(common.tobytes())
+            return result
+        # 遍历较小的集合，在较大的集合中二分查找
+        n = len(b)
+        return UserIdSet.from_sorted(x for x in a if (i := bisect_left(b, x)) < n and b[i] == x)
+
+    def _sorted(self) -> array:
+        self._flush()
+        return self._data
+
+    def to_bytes(self) -> bytes:
+        """序列化为原始 int64 字节，用于缓存"""
+        return self._sorted().tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "UserIdSet":
+        """从 to_bytes 的结果还原"""
+        result = cls()
+        result._data.frombytes(data)
+        return result
+
+    def __or__(self, other: "UserIdSet") -> "UserIdSet":
+        return self.union(other)
+
+    def __and__(self, other: "UserIdSet") -> "UserIdSet":
+        return self.intersection(other)
+
+    def __len__(self) -> int:
+        return len(self._sorted())
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._pending:
+            return True
+        i = bisect_left(self._data, user_id)
+        return i < len(self._data) and self._data[i] == user_id
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._sorted())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, UserIdSet):
+            return self._sorted() == other._sorted()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"UserIdSet(size={len(self)})"